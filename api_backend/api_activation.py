@@ -1,24 +1,50 @@
-import ast
+import os
+import asyncio
+import secrets
 import logging
+from contextlib import asynccontextmanager
 
 import uvicorn
 
-from fastapi import FastAPI, WebSocket
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Header, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-
-from law_rag.knowledge.db_connection import langchain_neo4j_vector
-from law_rag.models.llm_wrapper import (
-    get_llm_model, 
-    get_runnable_chain, 
-    make_config_for_chain,
-    retriever_answer
-)
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from pydantic import ValidationError
+
+from law_rag.knowledge.db_connection import check_connection
+from law_rag.knowledge.schema import verify_schema
+from law_rag.api.resources import Resources
+from law_rag.api.connection import ChatConnection
+from law_rag.api.protocol import parse_client_message, error_event
+from law_rag.api.batch import BatchRequest, answer_batch, ndjson_lines
 from law_rag.db_manager.data_management import generate_hex
+from law_rag import metrics
+from law_rag.profiling import sample_for
 from law_rag.config import Settings
 
 from dotenv import load_dotenv
 
-app = FastAPI()
+logger = logging.getLogger(__name__)
+
+# Only one profile at a time, the samples of two would be mixed
+profile_lock = asyncio.Lock()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Check that the graph schema (constraints for the lookups) exists
+    driver = check_connection()
+    verify_schema(driver)
+    driver.close()
+
+    # Models, vector stores and chains are loaded once and shared by all sessions
+    app.state.resources = Resources().load()
+
+    yield
+
+    app.state.resources.close()
+
+
+app = FastAPI(lifespan = lifespan)
 
 #------------------------
 # React could connect to FastApi WebSocket if some ports will be open along with CORS
@@ -40,70 +66,95 @@ def read_root():
     return {"message": "Wake up, Neo"}
 
 
+@app.post("/qa/batch")
+async def answer_questions(request: BatchRequest):
+    """Answer many questions at once
+
+    Results are in the input order: streamed as NDJSON (one JSON object per line) if `stream` is true,
+    otherwise returned as one JSON list. Every result has the timings of the stages.
+    """
+    resources: Resources = app.state.resources
+    if request.stream:
+        return StreamingResponse(ndjson_lines(request, resources), media_type = "application/x-ndjson")
+
+    return [result async for result in answer_batch(request, resources)]
+
+
+@app.get("/resources")
+def read_resources():
+    """Seconds spent to load the shared resources at startup, the cache, prompt size and LLM queue statistics"""
+    return {
+        "load_times": app.state.resources.load_times,
+        "retrieval_cache": app.state.resources.retrieval_cache.stats(),
+        "answer_cache": (
+            app.state.resources.answer_cache.stats()
+            if app.state.resources.answer_cache is not None else None
+        ),
+        "history_window": app.state.resources.history_window.stats(),
+        "llm_scheduler": app.state.resources.llm_scheduler.stats(),
+        "generations": app.state.resources.generation_stats.stats()
+    }
+
+
+@app.get("/metrics", response_class = PlainTextResponse)
+def read_metrics():
+    """Stage latency histograms (by retrieval mode), active sessions, cache hit rates and LLM queue in the Prometheus format"""
+    return PlainTextResponse(
+        metrics.render(app.state.resources.metrics()),
+        media_type = "text/plain; version=0.0.4"
+    )
+
+
+@app.get("/admin/profile", response_class = PlainTextResponse)
+async def read_profile(
+    seconds: float = Query(default = 10, gt = 0, le = Settings.api.profile_max_seconds),
+    x_admin_token: str | None = Header(default = None)
+):
+    """Sample the stacks of the whole process for `seconds` and return them in the collapsed stack format
+
+    The file could be given to flamegraph.pl or opened in speedscope.
+    The endpoint works only if the `ADMIN_TOKEN` environment variable is set, and the `X-Admin-Token` header matches it.
+    """
+    admin_token = os.environ.get("ADMIN_TOKEN")
+    if not admin_token:
+        raise HTTPException(status_code = 404, detail = "Not Found")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, admin_token):
+        raise HTTPException(status_code = 403, detail = "Wrong admin token")
+    if profile_lock.locked():
+        raise HTTPException(status_code = 409, detail = "Profile is already being taken")
+
+    async with profile_lock:
+        # The sampler sleeps in a thread, so the event loop keeps serving (and is sampled)
+        collapsed = await asyncio.to_thread(sample_for, seconds)
+
+    return PlainTextResponse(collapsed)
+
+
 @app.websocket("/ws/chat/")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
 
-    model = get_llm_model(
-        model_type = Settings.models.llm_model_type,
-        engine = Settings.models.llm_engine
-    )
-    
-    vector_graph_naive = langchain_neo4j_vector("naive")
-    vector_graph_holmes = langchain_neo4j_vector("holmes")
-
-    runnable_with_history = get_runnable_chain(model)
-    session_id = generate_hex()
-    config = make_config_for_chain(session_id)
-
-    while True:
-        data = await websocket.receive_text()
-        message = ast.literal_eval(data)["message"]
-
-        # RAG system
-        match Settings.web.mode:
-            case "all":
-                retriever_message_naive, raw_retriever_message_naive = retriever_answer(
-                    question = message,
-                    retriever = vector_graph_naive,
-                    return_also_raw_answer = True
-                )
-                retriever_message_holmes, raw_retriever_message_holmes = retriever_answer(
-                    question = message,
-                    retriever = vector_graph_holmes,
-                    return_also_raw_answer = True,
-                    ship_headers = True
-                )
-                retriever_message = retriever_message_naive + "\n\n" + retriever_message_holmes
-                raw_retriever_message = raw_retriever_message_naive + "\n\n### Триплеты\n" + raw_retriever_message_holmes
-            
-            case "naive":
-                retriever_message, raw_retriever_message = retriever_answer(
-                    question = message,
-                    retriever = vector_graph_naive,
-                    return_also_raw_answer = True
-                )
-
-            case "holmes":
-                retriever_message, raw_retriever_message = retriever_answer(
-                    question = message,
-                    retriever = vector_graph_holmes,
-                    return_also_raw_answer = True,
-                    ship_headers = True
-                )
-
-        if Settings.web.need_to_show_rag:
-            await websocket.send_json({
-                "event": "rag_system",
-                "name": "RAG",
-                "data": raw_retriever_message,
-                "run_id": "rag_system"
-            })
-
-        async for chunk in runnable_with_history.astream_events({'input': retriever_message}, version="v2", config=config):
-            if chunk["event"] in ["on_parser_start", "on_parser_stream"]:
-                await websocket.send_json(chunk)
+    resources: Resources = websocket.app.state.resources
+    connection = ChatConnection(websocket, generate_hex(), resources)
+    metrics.ACTIVE_SESSIONS.inc()
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            try:
+                client_message = parse_client_message(data)
+            except ValidationError as error:
+                await connection.send(error_event(f"Invalid message: {error.errors()[0]['msg']}"))
+                continue
+
+            await connection.submit(client_message)
+
+    except WebSocketDisconnect:
+        logger.info(f"Session {connection.session_id} is disconnected")
 
+    finally:
+        connection.cancel_all()
+        metrics.ACTIVE_SESSIONS.dec()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Concurrency check for the chat WebSocket.
+
+Several clients connect at once and send the same question. For every client it measures the time
+to the first event (the retrieval answer) and to the end of the streamed answer.
+If sessions are served concurrently, the time to the first event is close for all clients;
+if they are serialized, it grows linearly with the client number.
+
+With `--multiplex` all questions are sent over one connection with different request ids.
+
+Run it against the running API:
+```
+python api_backend/concurrency_check.py --clients 5
+python api_backend/concurrency_check.py --clients 4 --multiplex
+```
+"""
+import json
+import time
+import asyncio
+import argparse
+
+import websockets
+
+from typing import Dict, List
+
+
+async def one_client(url: str, question: str, idle_timeout: float) -> Dict[str, float]:
+    async with websockets.connect(url) as websocket:
+        start = time.perf_counter()
+        await websocket.send(json.dumps({"message": question}))
+
+        first_event = None
+        while True:
+            try:
+                await asyncio.wait_for(websocket.recv(), timeout = idle_timeout)
+            # The answer is over if nothing comes for a while
+            except asyncio.TimeoutError:
+                break
+
+            if first_event is None:
+                first_event = time.perf_counter() - start
+
+        return {
+            "first_event": first_event if first_event is not None else float("nan"),
+            "total": time.perf_counter() - start - idle_timeout
+        }
+
+
+async def one_connection(url: str, requests: int, question: str, idle_timeout: float) -> List[Dict[str, float]]:
+    """Several questions over one connection, events are split by the request id"""
+    async with websockets.connect(url) as websocket:
+        start = time.perf_counter()
+        for number in range(requests):
+            await websocket.send(json.dumps({"message": question, "request_id": str(number)}))
+
+        first_events: Dict[str, float] = {}
+        last_events: Dict[str, float] = {}
+        while True:
+            try:
+                frame = await asyncio.wait_for(websocket.recv(), timeout = idle_timeout)
+            except asyncio.TimeoutError:
+                break
+
+            request_id = json.loads(frame).get("request_id")
+            now = time.perf_counter() - start
+            first_events.setdefault(request_id, now)
+            last_events[request_id] = now
+
+        return [
+            {
+                "first_event": first_events.get(str(number), float("nan")),
+                "total": last_events.get(str(number), float("nan"))
+            }
+            for number in range(requests)
+        ]
+
+
+async def main(
+    url: str,
+    clients: int,
+    question: str,
+    idle_timeout: float,
+    multiplex: bool = False
+) -> List[Dict[str, float]]:
+    if multiplex:
+        results = await one_connection(url, clients, question, idle_timeout)
+    else:
+        results = await asyncio.gather(*[one_client(url, question, idle_timeout) for _ in range(clients)])
+
+    for number, result in enumerate(sorted(results, key = lambda item: item["first_event"])):
+        print(f"Client {number}: first event in {result['first_event']:.2f} s, answer in {result['total']:.2f} s")
+
+    first_events = [result["first_event"] for result in results]
+    print(f"Spread of the first events: {max(first_events) - min(first_events):.2f} s")
+    return results
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Several simultaneous chat clients")
+    parser.add_argument("--url", default = "ws://localhost:1702/ws/chat/")
+    parser.add_argument("--clients", type = int, default = 5)
+    parser.add_argument("--question", default = "Что такое персональные данные?")
+    parser.add_argument("--idle-timeout", type = float, default = 10.0)
+    parser.add_argument("--multiplex", action = "store_true", help = "Send all questions over one connection")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.url, args.clients, args.question, args.idle_timeout, args.multiplex))
@@ -1,12 +1,13 @@
 import numpy as np
 import pandas as pd
 
-from law_rag.models.embeddings_wrapper import HuggingFaceEmbeddings
+from law_rag.models.embeddings_wrapper import get_embeddings
 from law_rag.config import Settings
 from config import DatasetSettings
 
 from tqdm import tqdm
 
+from langchain_core.embeddings import Embeddings
 from typing import List
 
 def load_dataset(path: str) -> pd.DataFrame:
@@ -14,7 +15,7 @@ def load_dataset(path: str) -> pd.DataFrame:
     return qa_dataset
 
 
-def make_embeddings(texts: List[str], model: HuggingFaceEmbeddings) -> List[List[int]]:
+def make_embeddings(texts: List[str], model: Embeddings) -> List[List[int]]:
     embeddgins = model.embed_documents(texts)
     return embeddgins
 
@@ -33,7 +34,7 @@ def similarity_score(A: List[int], B: List[int]) -> float:
 
 def main():
     dataset = load_dataset(DatasetSettings.qa_dataset.path_to_full_save_csv)
-    model = HuggingFaceEmbeddings(Settings.models.embeddings_model)
+    model = get_embeddings()
 
     if not Settings.system.silent_creation:
         print("Dataset and model were loaded")
@@ -9,5 +9,7 @@ from . import db_manager
 
 # Other important scripts
 from . import config
+from . import metrics
+from . import profiling
 from . import build_graph
 from . import holmes_build_graph
\ No newline at end of file
@@ -0,0 +1,10 @@
+"""
+This module contains the parts of the API backend that are shared by all sessions: loaded models, caches, schedulers, etc.
+"""
+from . import resources
+from . import caches
+from . import retrieval
+from . import answering
+from . import protocol
+from . import connection
+from . import batch
@@ -0,0 +1,220 @@
+"""
+One chat turn for the API: retrieval, LLM answer and the events for the frontend.
+
+Events are the ones that the frontend reads: `rag_system` with the retrieved context,
+`queue` with the position while the request waits for the LLM, then `on_parser_start` and `on_parser_stream`
+with the answer chunks. With `web.protocol: lean` the answer events carry only the fields the frontend reads
+(see `law_rag.api.protocol`), with `events` they are the full `astream_events` (version "v2") ones.
+"""
+import re
+import time
+import asyncio
+from uuid import uuid4
+from contextlib import aclosing
+
+from langchain_core.messages import HumanMessage, AIMessage
+
+from law_rag.api.resources import Resources
+from law_rag.api.caches import CachedAnswer
+from law_rag.api.retrieval import retrieve, current_graph_version, embed_question
+from law_rag.api.protocol import stream_start_event, stream_chunk_event, coalesce
+from law_rag.models.llm_wrapper import make_config_for_chain, LLMQueueFull
+from law_rag.models.blanks import OVERLOADED_MESSAGE
+from law_rag.models.tokens import estimate_tokens
+from law_rag.metrics import MODE, STAGE_SECONDS, TURNS, GenerationTimer
+from law_rag.config import Settings
+
+from typing import Any, AsyncIterator, Dict, Iterator
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def rag_event(raw_retriever_message: str) -> Dict[str, Any]:
+    """Event with the retrieved context to show to the user"""
+    return {
+        "event": "rag_system",
+        "name": "RAG",
+        "data": raw_retriever_message,
+        "run_id": "rag_system"
+    }
+
+
+def queue_event(position: int) -> Dict[str, Any]:
+    """Event with the number of requests that will be answered before this one"""
+    return {
+        "event": "queue",
+        "name": "LLM",
+        "data": {"position": position},
+        "run_id": "queue"
+    }
+
+
+def stored_answer_events(
+    answer: str,
+    run_name: str = Settings.web.run_name,
+    words_per_chunk: int = 8
+) -> Iterator[Dict[str, Any]]:
+    """Events of the already known answer, in the same shape as the streamed LLM answer"""
+    run_id = str(uuid4())
+    yield stream_start_event(run_id, run_name)
+
+    # Words keep their trailing whitespace, so the chunks sum up to the answer
+    words = re.findall(r"\s*\S+\s*", answer)
+    for start in range(0, len(words), words_per_chunk):
+        yield stream_chunk_event(run_id, "".join(words[start : start + words_per_chunk]), run_name)
+
+
+async def answer_events(
+    message: str,
+    session_id: str,
+    resources: Resources,
+    queue_id: str | None = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Answer the user message and yield the events for the frontend
+
+    If a similar enough question was already answered with the same mode on the same graph version,
+    the stored answer is sent without retrieval and LLM generation, and it is added to the session history.
+
+    Arguments
+    ---------
+    message: str
+        User message
+    session_id: str
+        Session id for the chat history
+    resources: Resources
+        Shared models, vector stores and caches
+    queue_id: str | None = None
+        Key of the request in the fair LLM queue. If None, it is the `session_id`
+    """
+    mode = Settings.web.mode
+    # The turn runs in its own task, so the mode label does not leak to the other turns
+    MODE.set(mode)
+    answer_cache = resources.answer_cache
+
+    version = await current_graph_version(resources)
+    embedding = await embed_question(message, resources) if answer_cache is not None else None
+
+    if answer_cache is not None:
+        cached = answer_cache.get(embedding, mode, version)
+        if cached is not None:
+            logger.info(f"Answer is taken from the cache, {cached.generation_time:.2f} s of generation are saved")
+
+            if Settings.web.need_to_show_rag:
+                yield rag_event(cached.raw_retriever_message)
+
+            history = resources.runnable_with_history.get_session_history(session_id)
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                resources.executor,
+                history.add_messages,
+                [HumanMessage(content = cached.retriever_message), AIMessage(content = cached.answer)]
+            )
+
+            TURNS.inc(result = "cached")
+            for event in stored_answer_events(cached.answer):
+                yield event
+            return
+
+    # RAG system
+    retriever_message, raw_retriever_message = await retrieve(
+        question = message,
+        mode = mode,
+        resources = resources,
+        embedding = embedding,
+        version = version
+    )
+
+    if Settings.web.need_to_show_rag:
+        yield rag_event(raw_retriever_message)
+
+    # Wait for the LLM slot
+    scheduler = resources.llm_scheduler
+    # Only the waiting is timed, not the sending of the queue events to the client
+    waited = 0.0
+    try:
+        async with aclosing(scheduler.acquire(queue_id or session_id)) as positions:
+            wait_start = time.perf_counter()
+            async for position in positions:
+                waited += time.perf_counter() - wait_start
+                yield queue_event(position)
+                wait_start = time.perf_counter()
+            waited += time.perf_counter() - wait_start
+        STAGE_SECONDS.observe(waited, stage = "llm_queue")
+
+    except LLMQueueFull as error:
+        logger.warning(f"Request of the session {session_id} is rejected: {error}")
+        TURNS.inc(result = "rejected")
+        for event in stored_answer_events(OVERLOADED_MESSAGE):
+            yield event
+        return
+
+    # LLM
+    # If the turn is cancelled, closing the stream aborts the Ollama request, and the chain
+    # ends with an error, so neither the question nor the partial answer is written to the history
+    start = time.perf_counter()
+    timer = GenerationTimer()
+    answer_parts = []
+    completed = False
+    cancelled = False
+    try:
+        match Settings.web.protocol:
+            case "lean":
+                # The parser output is consumed directly, without the events machinery
+                run_id = str(uuid4())
+                yield stream_start_event(run_id)
+
+                # The stream is closed explicitly, so the upstream request is aborted at once, not at the garbage collection
+                # The first token is noted before the coalescing window delays it
+                async with aclosing(resources.runnable_with_history.astream(
+                    {"input": retriever_message},
+                    config = make_config_for_chain(session_id)
+                )) as stream, aclosing(timer.watch(stream)) as tokens, aclosing(coalesce(tokens)) as chunks:
+                    async for chunk in chunks:
+                        answer_parts.append(chunk)
+                        yield stream_chunk_event(run_id, chunk)
+
+            case "events":
+                async with aclosing(resources.runnable_with_history.astream_events(
+                    {"input": retriever_message},
+                    version = "v2",
+                    config = make_config_for_chain(session_id)
+                )) as stream:
+                    async for chunk in stream:
+                        if chunk["event"] in ["on_parser_start", "on_parser_stream"]:
+                            if chunk["event"] == "on_parser_stream":
+                                timer.token()
+                                answer_parts.append(chunk["data"]["chunk"])
+                            yield chunk
+        completed = True
+
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away or sent a new message
+        cancelled = True
+        raise
+
+    finally:
+        scheduler.release()
+        if completed:
+            resources.generation_stats.finish("".join(answer_parts))
+            timer.finish(estimate_tokens("".join(answer_parts)))
+            TURNS.inc(result = "generated")
+        elif cancelled:
+            resources.generation_stats.cancel("".join(answer_parts))
+            TURNS.inc(result = "cancelled")
+            logger.info(f"Generation of the session {session_id} is cancelled")
+        else:
+            # An error of the LLM (e.g. Ollama is unreachable) is not a cancellation, nothing is saved by it
+            resources.generation_stats.fail()
+            TURNS.inc(result = "failed")
+            logger.error(f"Generation of the session {session_id} failed")
+
+    if answer_cache is not None and answer_parts:
+        answer_cache.put(embedding, CachedAnswer(
+            mode = mode,
+            version = version,
+            retriever_message = retriever_message,
+            raw_retriever_message = raw_retriever_message,
+            answer = "".join(answer_parts),
+            generation_time = time.perf_counter() - start
+        ))
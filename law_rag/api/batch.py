@@ -0,0 +1,153 @@
+"""
+Batch question answering for the bulk workloads.
+
+All questions are embedded in one batched call, retrieved concurrently in the retrieval thread pool,
+and answered by the LLM with bounded concurrency. The LLM requests go through the shared `LLMScheduler`
+as one session, so a big batch does not push the chat users out of the queue.
+Results are given in the input order, every one with its timings.
+"""
+import json
+import time
+import asyncio
+from contextlib import aclosing
+
+from pydantic import BaseModel, Field
+
+from law_rag.api.resources import Resources
+from law_rag.api.retrieval import retrieve, current_graph_version
+from law_rag.models.llm_wrapper import LLMQueueFull
+from law_rag.models.tokens import estimate_tokens
+from law_rag.db_manager.data_management import generate_hex
+from law_rag.metrics import MODE, STAGE_SECONDS, TURNS, GenerationTimer, in_context
+from law_rag.config import Settings
+
+from typing import Any, AsyncIterator, Dict, List, Literal
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class BatchRequest(BaseModel):
+    """Body of the batch question answering request"""
+    questions: List[str] = Field(min_length = 1, max_length = Settings.api.batch_max_questions)
+    mode: Literal["all", "naive", "holmes"] = Settings.web.mode
+    stream: bool = True
+
+
+async def _answer_one(
+    index: int,
+    question: str,
+    embedding: List[float],
+    request: BatchRequest,
+    version: str | None,
+    batch_id: str,
+    semaphore: asyncio.Semaphore,
+    resources: Resources
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    result: Dict[str, Any] = {"index": index, "question": question}
+
+    try:
+        retriever_message, _ = await retrieve(
+            question = question,
+            mode = request.mode,
+            resources = resources,
+            embedding = embedding,
+            version = version
+        )
+        retrieved = time.perf_counter()
+        result["retrieval_seconds"] = round(retrieved - start, 3)
+
+        async with semaphore:
+            scheduler = resources.llm_scheduler
+            async with aclosing(scheduler.acquire(batch_id)) as positions:
+                async for _ in positions:
+                    pass
+            admitted = time.perf_counter()
+            STAGE_SECONDS.observe(admitted - retrieved, stage = "llm_queue")
+
+            timer = GenerationTimer()
+            try:
+                answer = await resources.qa_chain.ainvoke({"input": retriever_message})
+
+            except asyncio.CancelledError:
+                # The client went away before the end of the batch
+                resources.generation_stats.cancel("")
+                TURNS.inc(result = "cancelled")
+                raise
+
+            except Exception:
+                # The failure is counted in TURNS below
+                resources.generation_stats.fail()
+                raise
+
+            finally:
+                scheduler.release()
+
+            result["answer"] = answer
+            resources.generation_stats.finish(answer)
+            timer.finish(estimate_tokens(answer))
+            TURNS.inc(result = "generated")
+
+        result["queue_seconds"] = round(admitted - retrieved, 3)
+        result["generation_seconds"] = round(time.perf_counter() - admitted, 3)
+
+    except LLMQueueFull as error:
+        TURNS.inc(result = "rejected")
+        result["error"] = str(error)
+
+    except Exception as error:
+        logger.exception(f"Batch question {index} failed")
+        TURNS.inc(result = "failed")
+        result["error"] = repr(error)
+
+    result["total_seconds"] = round(time.perf_counter() - start, 3)
+    return result
+
+
+async def answer_batch(request: BatchRequest, resources: Resources) -> AsyncIterator[Dict[str, Any]]:
+    """Answer all questions of the batch and yield the results in the input order
+
+    Every result has `index`, `question`, `answer` (or `error`) and the timings:
+    `embedding_seconds` (of the whole batch), `retrieval_seconds`, `queue_seconds`,
+    `generation_seconds` and `total_seconds`.
+    """
+    start = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    # The item tasks copy the context, so they are labelled with the batch mode
+    MODE.set(request.mode)
+
+    version = await current_graph_version(resources)
+    # One batched pass of the embeddings model for all questions
+    embeddings = await loop.run_in_executor(
+        resources.executor,
+        in_context(resources.embeddings.embed_documents, request.questions)
+    )
+    embedding_seconds = round(time.perf_counter() - start, 3)
+    STAGE_SECONDS.observe(embedding_seconds, stage = "batch_embedding")
+
+    batch_id = f"batch-{generate_hex()}"
+    semaphore = asyncio.Semaphore(Settings.api.batch_generation_concurrency)
+    tasks = [
+        asyncio.create_task(_answer_one(
+            index, question, embedding, request, version, batch_id, semaphore, resources
+        ))
+        for index, (question, embedding) in enumerate(zip(request.questions, embeddings))
+    ]
+
+    try:
+        for task in tasks:
+            result = await task
+            yield {**result, "embedding_seconds": embedding_seconds}
+
+    finally:
+        # The client could go away before the end
+        for task in tasks:
+            task.cancel()
+
+
+async def ndjson_lines(request: BatchRequest, resources: Resources) -> AsyncIterator[str]:
+    """Results as newline-delimited JSON"""
+    async with aclosing(answer_batch(request, resources)) as results:
+        async for result in results:
+            yield json.dumps(result, ensure_ascii = False) + "\n"
@@ -0,0 +1,246 @@
+"""
+In-process caches of the API:
+- `RetrievalCache` - retrieval results by the normalized question
+- `AnswerCache` - LLM answers by the question embedding, so paraphrases of a question are answered without the LLM
+
+Cached values remember the graph version they were made with (see `law_rag.knowledge.graph_version`),
+so they become invalid automatically after the graph is rebuilt.
+"""
+import re
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from neo4j import Driver
+from pydantic import BaseModel
+
+from law_rag.knowledge.graph_version import get_graph_version
+from law_rag.config import Settings
+
+from typing import Any, Dict, List, Tuple, Hashable
+
+
+def normalize_question(question: str) -> str:
+    """Question form for the cache key: lower case, single spaces, no trailing punctuation"""
+    question = re.sub(r"\s+", " ", question.lower()).strip()
+    return question.rstrip("?!.… ")
+
+
+class GraphVersion:
+    """Current graph version that is asked from Neo4j not more often than once in `check_interval` seconds
+
+    Parameters
+    ----------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    check_interval: float
+        Seconds between version requests
+    """
+    def __init__(
+        self,
+        driver: Driver,
+        check_interval: float = Settings.cache.version_check_interval
+    ) -> None:
+        self.driver = driver
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._version: str | None = None
+        self._checked_at = float("-inf")
+
+    def current(self) -> str | None:
+        """It could make a blocking request to Neo4j, so call it from a thread in async code"""
+        with self._lock:
+            if time.monotonic() - self._checked_at >= self.check_interval:
+                self._version = get_graph_version(self.driver)
+                self._checked_at = time.monotonic()
+            return self._version
+
+
+class RetrievalCache:
+    """LRU cache with TTL of the retrieval results
+
+    Parameters
+    ----------
+    max_entries: int
+        Maximum number of cached results. The least recently used are evicted
+    ttl: float
+        Seconds while the result is valid
+    """
+    def __init__(
+        self,
+        max_entries: int = Settings.cache.retrieval_max_entries,
+        ttl: float = Settings.cache.retrieval_ttl
+    ) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        # key -> (value, graph version, creation time)
+        self._entries: OrderedDict[Hashable, Tuple[Any, str | None, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(question: str, mode: str, k: int) -> Tuple[str, str, int]:
+        return normalize_question(question), mode, k
+
+    def get(self, key: Hashable, version: str | None) -> Any | None:
+        """Cached value, if it exists, is not expired and was made with this graph version"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, entry_version, created = entry
+                if entry_version == version and time.monotonic() - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                # Expired or made with another graph
+                del self._entries[key]
+
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, version: str | None, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (value, version, time.monotonic())
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last = False)
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0
+        }
+
+
+class CachedAnswer(BaseModel):
+    """LLM answer stored in the `AnswerCache`
+
+    Parameters
+    ----------
+    mode: str
+        Retrieval mode the answer was made with
+    version: str | None
+        Graph version the answer was made with
+    retriever_message: str
+        The question with the retrieved context, as it was given to the LLM
+    raw_retriever_message: str
+        Raw retrieved context to show to the user
+    answer: str
+        LLM answer
+    generation_time: float
+        Seconds the LLM spent to generate the answer
+    """
+    mode: str
+    version: str | None
+    retriever_message: str
+    raw_retriever_message: str
+    answer: str
+    generation_time: float
+
+
+class AnswerCache:
+    """Semantic cache of the LLM answers
+
+    The answer is found by the nearest cached question embedding (cosine similarity),
+    if it is not less than `threshold` and the answer was made with the same mode and graph version.
+    Embeddings are kept in one matrix, so the lookup is one matrix-vector product.
+
+    Parameters
+    ----------
+    max_entries: int
+        Maximum number of cached answers. The least recently used are evicted
+    threshold: float
+        Minimum cosine similarity of the questions to reuse the answer
+    dimension: int
+        Embeddings dimension
+    """
+    def __init__(
+        self,
+        max_entries: int = Settings.cache.answer_max_entries,
+        threshold: float = Settings.cache.answer_similarity_threshold,
+        dimension: int = Settings.models.embeddings_dimension
+    ) -> None:
+        self.max_entries = max_entries
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        self._vectors = np.zeros((max_entries, dimension), dtype = np.float32)
+        self._entries: List[CachedAnswer | None] = [None] * max_entries
+        # Occupied slots from the least to the most recently used
+        self._usage: OrderedDict[int, None] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.saved_generation_time = 0.0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype = np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _free(self, slot: int) -> None:
+        self._entries[slot] = None
+        self._vectors[slot] = 0.0
+        self._usage.pop(slot, None)
+
+    def get(self, embedding: List[float], mode: str, version: str | None) -> CachedAnswer | None:
+        """Cached answer for the most similar question, if it is similar enough"""
+        query = self._normalize(embedding)
+
+        with self._lock:
+            if self._usage:
+                slots = np.fromiter(self._usage.keys(), dtype = np.int64)
+                scores = self._vectors[slots] @ query
+
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+
+                    slot = int(slots[position])
+                    entry = self._entries[slot]
+                    if entry.version != version:
+                        # Made with another graph
+                        self._free(slot)
+                        continue
+
+                    if entry.mode == mode:
+                        self._usage.move_to_end(slot)
+                        self.hits += 1
+                        self.saved_generation_time += entry.generation_time
+                        return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, embedding: List[float], entry: CachedAnswer) -> None:
+        with self._lock:
+            if len(self._usage) < self.max_entries:
+                # The first never used slot
+                slot = next(index for index, stored in enumerate(self._entries) if stored is None)
+            else:
+                slot, _ = self._usage.popitem(last = False)
+
+            self._vectors[slot] = self._normalize(embedding)
+            self._entries[slot] = entry
+            self._usage[slot] = None
+
+    def stats(self) -> Dict[str, float]:
+        requests = self.hits + self.misses
+        return {
+            "entries": len(self._usage),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "saved_generation_seconds": round(self.saved_generation_time, 3)
+        }
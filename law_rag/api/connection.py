@@ -0,0 +1,114 @@
+"""
+One chat WebSocket connection with several concurrent questions.
+
+A client frame could have a `request_id`. Questions with different ids are answered concurrently
+(up to `api.max_requests_per_connection`), and every event of the answer is tagged with its `request_id`.
+A question without the id is the usual chat message: the next such message cancels the unfinished answer.
+
+Every request id has it's own chat history (`<session id>:<request id>`), so concurrent questions
+never read or write the same history. At most one answer per history runs at a time:
+the message without the id supersedes the previous one, and a running request id is rejected.
+"""
+import asyncio
+from contextlib import aclosing
+
+from fastapi import WebSocket
+
+from law_rag.api.resources import Resources
+from law_rag.api.answering import answer_events
+from law_rag.api.protocol import ClientMessage, error_event
+from law_rag.config import Settings
+
+from typing import Any, Dict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ChatConnection:
+    """Answer tasks of one WebSocket connection
+
+    Parameters
+    ----------
+    websocket: WebSocket
+        Accepted WebSocket
+    session_id: str
+        Session id of the chat history of the messages without the request id.
+        It is also the key of the connection in the fair LLM queue
+    resources: Resources
+        Shared models, vector stores and caches
+    max_requests: int
+        Maximum number of questions that are answered at the same time
+    """
+    def __init__(
+        self,
+        websocket: WebSocket,
+        session_id: str,
+        resources: Resources,
+        max_requests: int = Settings.api.max_requests_per_connection
+    ) -> None:
+        self.websocket = websocket
+        self.session_id = session_id
+        self.resources = resources
+        self.max_requests = max_requests
+
+        # Request id (None for the messages without it) -> answer task
+        self.tasks: Dict[str | None, asyncio.Task] = {}
+        # Frames of the concurrent answers should not be sent at the same time
+        self._send_lock = asyncio.Lock()
+
+    async def send(self, event: Dict[str, Any], request_id: str | None = None) -> None:
+        if request_id is not None:
+            event = {**event, "request_id": request_id}
+        async with self._send_lock:
+            await self.websocket.send_json(event)
+
+    def history_id(self, request_id: str | None) -> str:
+        """Chat history key of the request"""
+        return self.session_id if request_id is None else f"{self.session_id}:{request_id}"
+
+    async def _answer(self, message: str, request_id: str | None) -> None:
+        # On the cancellation the events generator is closed at once, and it aborts the generation
+        async with aclosing(answer_events(
+            message,
+            self.history_id(request_id),
+            self.resources,
+            queue_id = self.session_id
+        )) as events:
+            async for event in events:
+                await self.send(event, request_id)
+
+    def _forget(self, request_id: str | None, task: asyncio.Task) -> None:
+        if self.tasks.get(request_id) is task:
+            del self.tasks[request_id]
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Answer of the session {self.session_id} failed", exc_info = task.exception())
+
+    async def submit(self, client_message: ClientMessage) -> None:
+        """Start answering the message"""
+        request_id = client_message.request_id
+
+        if request_id is None:
+            # A new message supersedes the unfinished answer
+            task = self.tasks.get(None)
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions = True)
+
+        elif request_id in self.tasks:
+            await self.send(error_event(f"Request {request_id} is already running"), request_id)
+            return
+
+        if len(self.tasks) >= self.max_requests:
+            await self.send(error_event(f"Only {self.max_requests} requests could run at the same time"), request_id)
+            return
+
+        task = asyncio.create_task(self._answer(client_message.message, request_id))
+        task.add_done_callback(lambda done: self._forget(request_id, done))
+        self.tasks[request_id] = task
+
+    def cancel_all(self) -> None:
+        """Cancel all unfinished answers, nobody is waiting for them anymore"""
+        for task in self.tasks.values():
+            task.cancel()
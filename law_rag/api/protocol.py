@@ -0,0 +1,122 @@
+"""
+Lean WebSocket protocol of the chat.
+
+Incoming frames are validated JSON objects (`ClientMessage`). Outgoing answer frames carry only the fields
+the frontend reads: `event`, `name`, `run_id` and `data.chunk`. The LLM output stream is coalesced
+into frames by a time or size window (`web.coalesce_ms`, `web.coalesce_chars`),
+so one frame carries several tokens.
+"""
+import time
+import asyncio
+from contextlib import suppress
+
+from pydantic import BaseModel, Field
+
+from law_rag.config import Settings
+
+from typing import Any, AsyncIterator, Dict
+
+
+class ClientMessage(BaseModel):
+    """Frame from the client: `{"message": "..."}` or `{"message": "...", "request_id": "..."}`
+
+    Messages with different `request_id` are answered concurrently, and their events are tagged with it
+    """
+    message: str = Field(min_length = 1, max_length = Settings.web.max_message_chars)
+    request_id: str | None = Field(default = None, min_length = 1, max_length = 64)
+
+
+def parse_client_message(data: str) -> ClientMessage:
+    """Validate the incoming frame
+
+    Raises
+    ------
+    pydantic.ValidationError
+        If the frame is not a JSON object with a non-empty `message` string (and an optional `request_id` string)
+    """
+    return ClientMessage.model_validate_json(data)
+
+
+def error_event(error: str) -> Dict[str, Any]:
+    """Event about the rejected frame"""
+    return {
+        "event": "error",
+        "name": "API",
+        "data": error,
+        "run_id": "error"
+    }
+
+
+def stream_start_event(run_id: str, run_name: str = Settings.web.run_name) -> Dict[str, Any]:
+    return {"event": "on_parser_start", "name": run_name, "run_id": run_id}
+
+
+def stream_chunk_event(run_id: str, chunk: str, run_name: str = Settings.web.run_name) -> Dict[str, Any]:
+    return {"event": "on_parser_stream", "name": run_name, "run_id": run_id, "data": {"chunk": chunk}}
+
+
+async def coalesce(
+    stream: AsyncIterator[str],
+    window_ms: float = Settings.web.coalesce_ms,
+    max_chars: int = Settings.web.coalesce_chars
+) -> AsyncIterator[str]:
+    """Join the stream chunks into bigger ones
+
+    The first chunk is given at once, so the coalescing does not delay the first visible token.
+    Then the joined chunk is given when it has `max_chars` characters or when the first chunk in it
+    has waited for `window_ms` milliseconds, even if the next chunk has not come yet.
+    The rest is given at the end of the stream.
+    """
+    buffer = []
+    size = 0
+    deadline = 0.0
+    first = True
+    # The next chunk is awaited in a task, so the window timeout does not cancel the stream
+    pending: asyncio.Task | None = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(anext(stream))
+
+            timeout = max(deadline - time.perf_counter(), 0.0) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout = timeout)
+
+            if not done:
+                # The window is over before the next chunk
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+                continue
+
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                pending = None
+                break
+            pending = None
+
+            if first:
+                first = False
+                yield chunk
+                continue
+
+            if not buffer:
+                deadline = time.perf_counter() + window_ms / 1000
+            buffer.append(chunk)
+            size += len(chunk)
+
+            if size >= max_chars:
+                yield "".join(buffer)
+                buffer = []
+                size = 0
+
+        if buffer:
+            yield "".join(buffer)
+
+    finally:
+        # The stream could be closed by the caller only when it does not wait for the next chunk
+        if pending is not None:
+            pending.cancel()
+            with suppress(asyncio.CancelledError, Exception):
+                await pending
@@ -0,0 +1,169 @@
+"""
+Registry of heavy resources for the API: the embeddings model, vector stores, the LLM and the chain.
+
+They are loaded once at the API startup and shared by all WebSocket sessions,
+so a new connection only needs a new session id.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from neo4j import Driver
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.runnables.base import RunnableSerializable
+from langchain_neo4j import Neo4jGraph, Neo4jVector
+from langchain_ollama import ChatOllama
+
+from law_rag.knowledge.db_connection import langchain_neo4j_vector, langchain_neo4j_connection, check_connection
+from law_rag.db_manager.data_management import get_history_store
+from law_rag.api.caches import GraphVersion, RetrievalCache, AnswerCache
+from law_rag.models.embeddings_wrapper import get_embeddings
+from law_rag.models.llm_wrapper import (
+    get_llm_model,
+    get_runnable_chain,
+    get_qa_chain,
+    LLMScheduler,
+    GenerationStats
+)
+from law_rag.models.history_window import HistoryWindow
+from law_rag.metrics import Metric, Counter, Gauge
+from law_rag.config import Settings
+
+from typing import Dict, Callable, List, TypeVar
+
+import logging
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Resources:
+    """Models, vector stores and chains shared by all sessions
+
+    Parameters
+    ----------
+    embeddings: Embeddings
+        Embeddings model. It is the same for both vector stores
+    graph: Neo4jGraph
+        Connection shared by both vector stores
+    vector_graph_naive: Neo4jVector
+        Vector store over the Codex hierarchy nodes
+    vector_graph_holmes: Neo4jVector
+        Vector store over the HOLMES Entity nodes
+    model: ChatOllama
+        LLM model
+    runnable_with_history: RunnableWithMessageHistory
+        Chain with the history. Sessions are separated by the session id in the chain config
+    qa_chain: RunnableSerializable
+        Chain without the history for the batch answering
+    history_window: HistoryWindow
+        Token-budgeted history policy of the chain
+    llm_scheduler: LLMScheduler
+        Admission control and fair queue of the LLM generations
+    generation_stats: GenerationStats
+        Completed, cancelled and failed generations
+    executor: ThreadPoolExecutor
+        Bounded thread pool for the blocking retrieval, so the event loop is not stalled
+    driver: neo4j.Driver
+        Driver for the service requests (graph version)
+    graph_version: GraphVersion
+        Current graph version, checked not more often than `cache.version_check_interval`
+    retrieval_cache: RetrievalCache
+        Retrieval results of the recent questions
+    answer_cache: AnswerCache | None
+        LLM answers by the question embedding. None if it is disabled in the config
+    load_times: Dict[str, float]
+        Seconds spent to load every resource
+    """
+    def __init__(self) -> None:
+        self.embeddings: Embeddings | None = None
+        self.graph: Neo4jGraph | None = None
+        self.vector_graph_naive: Neo4jVector | None = None
+        self.vector_graph_holmes: Neo4jVector | None = None
+        self.model: ChatOllama | None = None
+        self.runnable_with_history: RunnableWithMessageHistory | None = None
+        self.qa_chain: RunnableSerializable | None = None
+        self.history_window = HistoryWindow()
+        self.llm_scheduler = LLMScheduler()
+        self.generation_stats = GenerationStats()
+        self.executor = ThreadPoolExecutor(
+            max_workers = Settings.api.retrieval_workers,
+            thread_name_prefix = "retrieval"
+        )
+        self.driver: Driver | None = None
+        self.graph_version: GraphVersion | None = None
+        self.retrieval_cache = RetrievalCache()
+        self.answer_cache = AnswerCache() if Settings.cache.answer_enabled else None
+        self.load_times: Dict[str, float] = {}
+
+    def _timed(self, name: str, load: Callable[[], T]) -> T:
+        start = time.perf_counter()
+        resource = load()
+        self.load_times[name] = round(time.perf_counter() - start, 3)
+        logger.info(f"{name} was loaded in {self.load_times[name]} s")
+        return resource
+
+    def load(self) -> "Resources":
+        """Load all resources. It takes seconds and gigabytes, so it should be called once"""
+        self.embeddings = self._timed("embeddings", get_embeddings)
+        self.graph = self._timed("graph", lambda: langchain_neo4j_connection(refresh_schema = False))
+        self.vector_graph_naive = self._timed(
+            "vector_graph_naive",
+            lambda: langchain_neo4j_vector("naive", self.embeddings, self.graph)
+        )
+        self.vector_graph_holmes = self._timed(
+            "vector_graph_holmes",
+            lambda: langchain_neo4j_vector("holmes", self.embeddings, self.graph)
+        )
+        self.model = self._timed(
+            "llm",
+            lambda: get_llm_model(
+                model_type = Settings.models.llm_model_type,
+                engine = Settings.models.llm_engine
+            )
+        )
+        self.runnable_with_history = self._timed("chain", lambda: get_runnable_chain(self.model, self.history_window))
+        self.qa_chain = get_qa_chain(self.model)
+        if Settings.web.history_backend == "sqlite":
+            self._timed("history_store", get_history_store)
+        self.driver = self._timed("driver", check_connection)
+        self.graph_version = GraphVersion(self.driver)
+        return self
+
+    def metrics(self) -> List[Metric]:
+        """Cache and LLM queue metrics, made from the current statistics"""
+        cache_hits = Counter("law_rag_cache_hits_total", "Cache hits", labels = ("cache",))
+        cache_misses = Counter("law_rag_cache_misses_total", "Cache misses", labels = ("cache",))
+        cache_hit_ratio = Gauge("law_rag_cache_hit_ratio", "Share of the cache requests that were hits", labels = ("cache",))
+        cache_entries = Gauge("law_rag_cache_entries", "Entries in the cache", labels = ("cache",))
+
+        caches = {"retrieval": self.retrieval_cache.stats()}
+        if self.answer_cache is not None:
+            caches["answer"] = self.answer_cache.stats()
+        for cache, stats in caches.items():
+            cache_hits.inc(stats["hits"], cache = cache)
+            cache_misses.inc(stats["misses"], cache = cache)
+            cache_hit_ratio.set(stats["hit_rate"], cache = cache)
+            cache_entries.set(stats["entries"], cache = cache)
+
+        scheduler = self.llm_scheduler.stats()
+        in_flight = Gauge("law_rag_llm_in_flight", "Generations running now")
+        in_flight.set(scheduler["in_flight"])
+        queue_depth = Gauge("law_rag_llm_queue_depth", "Requests waiting for the LLM")
+        queue_depth.set(scheduler["queue_depth"])
+        rejected = Counter("law_rag_llm_rejected_total", "Requests rejected because the LLM queue was full")
+        rejected.inc(scheduler["rejected"])
+
+        return [cache_hits, cache_misses, cache_hit_ratio, cache_entries, in_flight, queue_depth, rejected]
+
+    def close(self) -> None:
+        """Stop the thread pool, close the Neo4j drivers and the history store"""
+        self.executor.shutdown(wait = False, cancel_futures = True)
+        if Settings.web.history_backend == "sqlite":
+            get_history_store().close()
+        if self.driver is not None:
+            self.driver.close()
+        # The vector stores use the driver of this connection
+        if self.graph is not None:
+            self.graph.close()
@@ -0,0 +1,98 @@
+"""
+Retrieval for the API: the RAG answer for the chosen mode, through the retrieval cache.
+"""
+import time
+import asyncio
+
+from law_rag.api.resources import Resources
+from law_rag.api.caches import RetrievalCache
+from law_rag.models.llm_wrapper import aretriever_answer, aretriever_answer_all
+from law_rag.metrics import STAGE_SECONDS, in_context
+
+from typing import List, Literal, Tuple
+
+
+async def current_graph_version(resources: Resources) -> str | None:
+    """Graph version without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(resources.executor, resources.graph_version.current)
+
+
+async def embed_question(question: str, resources: Resources) -> List[float]:
+    """Question embedding without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(resources.executor, in_context(resources.embeddings.embed_query, question))
+
+
+async def retrieve(
+    question: str,
+    mode: Literal["all", "naive", "holmes"],
+    resources: Resources,
+    k: int = 3,
+    embedding: List[float] | None = None,
+    version: str | None = None
+) -> Tuple[str, str]:
+    """Get the retriever answer for the question
+
+    The same (normalized) question with the same mode and k is taken from the cache,
+    if the graph was not rebuilt since then.
+
+    Arguments
+    ---------
+    embedding: List[float] | None = None
+        Already computed question embedding. If None, the question is embedded by the retrievers
+    version: str | None = None
+        Already known graph version. If None, it is requested
+
+    Returns
+    -------
+    (retriever_message, raw_retriever_message): Tuple[str, str]
+        Answer for the LLM and raw answer to show to the user
+    """
+    if version is None:
+        version = await current_graph_version(resources)
+
+    key = RetrievalCache.key(question, mode, k)
+    cached = resources.retrieval_cache.get(key, version)
+    if cached is not None:
+        return cached
+
+    # Only the real retrievals are timed, the cache hits would hide them
+    start = time.perf_counter()
+    match mode:
+        case "all":
+            # The question is embedded once for both retrievers
+            answer = await aretriever_answer_all(
+                question = question,
+                embeddings = resources.embeddings,
+                retriever_naive = resources.vector_graph_naive,
+                retriever_holmes = resources.vector_graph_holmes,
+                executor = resources.executor,
+                embedding = embedding,
+                k = k
+            )
+
+        case "naive":
+            answer = await aretriever_answer(
+                question = question,
+                retriever = resources.vector_graph_naive,
+                executor = resources.executor,
+                return_also_raw_answer = True,
+                embedding = embedding,
+                k = k
+            )
+
+        case "holmes":
+            answer = await aretriever_answer(
+                question = question,
+                retriever = resources.vector_graph_holmes,
+                executor = resources.executor,
+                return_also_raw_answer = True,
+                ship_headers = True,
+                embedding = embedding,
+                k = k
+            )
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage = "retrieval", mode = mode)
+    resources.retrieval_cache.put(key, version, answer)
+    return answer
@@ -1,41 +1,40 @@
 """
 Build the Graph Database in Neo4j
 """
-from law_rag.knowledge.db_connection import langchain_neo4j_connection, langchain_neo4j_vector
+from law_rag.knowledge.db_connection import (
+    check_connection,
+    langchain_neo4j_connection,
+    langchain_neo4j_vector
+)
 from law_rag.documents.md_parser import document_split
 from law_rag.knowledge.graph_building import get_chunk_specification, get_chunk_number
-from law_rag.knowledge.commands import (
-    create_node_command, 
-    create_parent_relationship, 
-    create_previous_relationship,
-    delete_nodes,
-    delete_index,
-    create_embeddings_label
-)
+from law_rag.knowledge.bulk_ingestion import GraphBatch
+from law_rag.knowledge.schema import apply_schema
+from law_rag.knowledge.reset import reset_graph
+from law_rag.knowledge.commands import create_embeddings_label
 from law_rag.documents.common import list_files_in_foler
 from law_rag.knowledge.node_schema import Codex, Article
+from law_rag.knowledge.embedding_writer import write_embeddings
+from law_rag.knowledge.vector_index import create_vector_index
+from law_rag.knowledge.graph_version import bump_graph_version
+from law_rag.models.embeddings_wrapper import get_embeddings
 from law_rag.models.llm_wrapper import retriever_answer
+from law_rag.profiling import profile_run
 
 from law_rag.config import Settings
 
+from langchain_neo4j import Neo4jGraph
+
+import argparse
 from tqdm import tqdm
 from dotenv import load_dotenv
 
 
-def build_graph_from_scratch() -> None:
-    """Build the Graph Database in Neo4j
-
-    This very one function will build the whole knowledge graph  
-    from the markdown file. This file should be prompted in config file  
-    in this path:
-    ```
-    config/config.yaml
-    ```
+def collect_graph() -> GraphBatch:
+    """Collect all Codex nodes and relationships from the markdown files
 
     Steps
     -----
-    - Connect to Neo4j database instance
-    - Clear Database
     - Get Codex folder and path to file
     - Create Codex Node
     - Create all other Nodes
@@ -44,20 +43,17 @@ def build_graph_from_scratch() -> None:
         - Check if an Article that point belongs to is exists
             - If not, creates one
             - And create a relationship with Codex Node
-        - Get and run create node command
-        - Get create previous node relationship command
-            - And run it if previous node exists
-        - Get and run create parents relationships command
-    """
-    # Connect to Neo4j database instance
-    graph = langchain_neo4j_connection()
+        - Create node
+        - Create previous node relationship if previous node exists
+        - Create parents relationships
 
-    # Clear Database
-    graph.query(delete_index("naive"))
-    graph.query(delete_nodes("naive"))
-    if not Settings.system.silent_creation:
-        print("Database was cleared for build from scratch")
-        print()
+    Returns
+    -------
+    batch: GraphBatch
+        All nodes and relationships, ready to be written
+    """
+    # All nodes are collected first and written at once in the end
+    batch = GraphBatch()
 
     # Get Codex folder and path to file
     codexes = list_files_in_foler(Settings.documents.path_to_folder)
@@ -71,10 +67,7 @@ def build_graph_from_scratch() -> None:
             previous = None,
             parent = None
         )
-        command = create_node_command(node)
-        graph.query(command)
-        if not Settings.system.silent_creation:
-            print("The Codex Node was created")
+        batch.add_node(node)
 
         # Get the Codex text
         texts = document_split(codex)
@@ -106,35 +99,102 @@ def build_graph_from_scratch() -> None:
                         previous = article_previous,
                         parent = codex
                     )
-                    command = create_node_command(node)
-                    graph.query(command)
+                    batch.add_node(node)
                     # And create a relationship with Codex Node
-                    command = create_parent_relationship(node)
-                    graph.query(command)
+                    batch.add_parent_relationship(node)
                     
                     # Now that Article Node is exists
                     existing_articles.append(article)
 
-                # Get and run create node command
-                command = create_node_command(specs)
-                graph.query(command)
-
-                # Get create previous node relationship command
-                command = create_previous_relationship(specs)
-                # Run it is it's not a "None" string
-                if command != "None":
-                    graph.query(command)
-
-                # Get and run create parents relationships command
-                command = create_parent_relationship(specs)
-                graph.query(command)
+                # Create node, previous node relationship (if previous node exists)
+                # and parents relationships
+                batch.add_node(specs)
+                batch.add_previous_relationship(specs)
+                batch.add_parent_relationship(specs)
         
         if not Settings.system.silent_creation:
             print()
-            print(f"Knowledge Graph for {codex}-ФЗ was created")
+            print(f"Knowledge Graph for {codex}-ФЗ was prepared")
             print("-----")
             print()
-    
+
+    return batch
+
+
+def build_graph_from_scratch() -> None:
+    """Build the Graph Database in Neo4j
+
+    This very one function will build the whole knowledge graph  
+    from the markdown file. This file should be prompted in config file  
+    in this path:
+    ```
+    config/config.yaml
+    ```
+
+    Steps
+    -----
+    - Connect to Neo4j database instance
+    - Clear Database
+    - Apply the graph schema (constraints)
+    - Collect all nodes and relationships (see `collect_graph`)
+    - Write all collected nodes and relationships with bulk `UNWIND` commands
+    - Create embeddings
+    """
+    # Connect to Neo4j database instance
+    graph = langchain_neo4j_connection()
+    driver = check_connection()
+
+    # Clear Database
+    reset_graph(driver, "naive")
+    if not Settings.system.silent_creation:
+        print("Database was cleared for build from scratch")
+        print()
+
+    # Constraints for MERGE lookups by the Node number
+    apply_schema(driver)
+
+    batch = collect_graph()
+
+    # Write all nodes and relationships in batches
+    if not Settings.system.silent_creation:
+        print("Writing the Knowledge Graph...")
+    batch.write(driver, batch_size = Settings.build.batch_size)
+    driver.close()
+
+    finish_graph(graph)
+
+
+def update_graph() -> None:
+    """Update the Graph Database in Neo4j with only changed chunks
+
+    Every node stores the hash of it's content, so the new chunks are compared with the graph:
+    - new and changed nodes are written
+    - vanished nodes are deleted
+    - embeddings are removed only from nodes which text was changed,
+    so only them will be embedded again
+
+    The vector index is not dropped.
+    """
+    # Connect to Neo4j database instance
+    graph = langchain_neo4j_connection()
+    driver = check_connection()
+
+    # Constraints for MERGE lookups by the Node number
+    apply_schema(driver)
+
+    batch = collect_graph()
+
+    # Write only the difference
+    if not Settings.system.silent_creation:
+        print("Updating the Knowledge Graph...")
+    batch.write_incremental(driver, batch_size = Settings.build.batch_size)
+    driver.close()
+
+    finish_graph(graph)
+
+
+def finish_graph(graph: Neo4jGraph) -> None:
+    """Set the embeddings label, update the schema and build the missing embeddings"""
     # Create the very one embeddings node label with MultiLabel feature
     if not Settings.system.silent_creation:
         print("Creating MultiLabel for Embeddings...")
@@ -162,7 +222,20 @@ def build_embeddings():
         print(f"Model: {Settings.models.embeddings_model}")
         print("Please, wait...")
     
-    vector_graph = langchain_neo4j_vector("naive")
+    # Fill in missing embeddings page by page
+    embeddings = get_embeddings()
+    driver = check_connection()
+    write_embeddings(driver, embeddings, "naive")
+
+    # The index is created after the embeddings, so it is populated at once
+    create_vector_index(driver, "naive")
+
+    # The graph was changed, so the API caches made with the old graph are invalid now
+    bump_graph_version(driver)
+    driver.close()
+
+    # The index exists and all nodes have embeddings now, so it only connects to it
+    vector_graph = langchain_neo4j_vector("naive", embeddings)
 
     if not Settings.system.silent_creation:
         print("Embeddings was created and/or loaded")
@@ -178,5 +251,22 @@ def build_embeddings():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build the Knowledge Graph of the Codexes")
+    parser.add_argument(
+        "--incremental",
+        action = "store_true",
+        help = "Update only changed chunks instead of building from scratch"
+    )
+    parser.add_argument(
+        "--profile",
+        action = "store_true",
+        help = "Write pstats, collapsed stacks and top memory allocations of the build to the profile folder"
+    )
+    args = parser.parse_args()
+
     load_dotenv()
-    build_graph_from_scratch()
\ No newline at end of file
+    with profile_run("build_graph", enabled = args.profile):
+        if args.incremental:
+            update_graph()
+        else:
+            build_graph_from_scratch()
\ No newline at end of file
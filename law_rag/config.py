@@ -48,6 +48,20 @@ class Data(BaseModel):
     holmes_index_name: str
 
 
+class Build(BaseModel):
+    batch_size: int
+    holmes_loader: Literal["unwind", "apoc"]
+    delete_batch_size: int
+    embeddings_batch_size: int
+
+
+class VectorIndex(BaseModel):
+    quantization: bool
+    hnsw_m: int
+    hnsw_ef_construction: int
+    online_timeout: int
+
+
 class System(BaseModel):
     silent_creation: bool
     logging_file: str
@@ -55,10 +69,25 @@ class System(BaseModel):
     logging_level: Literal[10, 20, 30, 40, 50]
     ollama_base_url: str
     neo4j_base_url: str
+    profile_folder: str
+
+class EmbeddingsCacheCfg(BaseModel):
+    enabled: bool
+    path: str
+    max_size_mb: int
+
+class OnnxCfg(BaseModel):
+    path: str
+    quantize: bool
+    intra_op_threads: int
 
 class Models(BaseModel):
     embeddings_model: str
     embeddings_dimension: int
+    embeddings_batch_size: int
+    embeddings_cache: EmbeddingsCacheCfg
+    embeddings_engine: Literal["torch", "onnx"]
+    onnx: OnnxCfg
     similarity_function: Literal["cosine", "euclidean"]
     llm_model_type: Literal["qwen3:8b", "deepseek-r1:8b", "gemma3:4b", "gemma3:27b"]
     llm_engine: Literal["ollama"]
@@ -66,19 +95,61 @@ class Models(BaseModel):
 class Api(BaseModel):
     host: str
     port: int
+    retrieval_workers: int
+    llm_max_in_flight: int
+    llm_max_queue: int
+    max_requests_per_connection: int
+    batch_max_questions: int
+    batch_generation_concurrency: int
+    profile_max_seconds: int
+    profile_interval_ms: int
+
+class CacheCfg(BaseModel):
+    retrieval_max_entries: int
+    retrieval_ttl: float
+    version_check_interval: float
+    answer_enabled: bool
+    answer_max_entries: int
+    answer_similarity_threshold: float
+
+class ContextCfg(BaseModel):
+    budget_tokens: int
+    holmes_budget_tokens: int
+
+class HistoryCfg(BaseModel):
+    budget_tokens: int
+    keep_exchanges: int
+    summarize: bool
+    summary_max_tokens: int
+    chars_per_token: float
 
 class WebCfg(BaseModel):
     run_name: str
     path_to_history: str
+    history_backend: Literal["sqlite", "file"]
+    history_db: str
+    history_hot_window: int
+    history_hot_sessions: int
+    history_ttl: float
+    history_gc_interval: float
     mode: Literal["all", "naive", "holmes"]
     need_to_show_rag: bool
+    protocol: Literal["lean", "events"]
+    coalesce_ms: float
+    coalesce_chars: int
+    max_message_chars: int
 
 class Config(BaseModel):
     documents: Docs
     data: Data
+    build: Build
+    vector_index: VectorIndex
     system: System
     models: Models
     api: Api
+    cache: CacheCfg
+    context: ContextCfg
+    history: HistoryCfg
     web: WebCfg
 
 
@@ -1 +1,2 @@
-from . import data_management
\ No newline at end of file
+from . import data_management
+from . import history_store
@@ -1,9 +1,16 @@
 import secrets
+import threading
 
 from langchain_community.chat_message_histories.file import FileChatMessageHistory
 
+from langchain_core.chat_history import BaseChatMessageHistory
+
+from law_rag.db_manager.history_store import HistoryStore, StoreChatMessageHistory
 from law_rag.config import Settings
 
+_history_store: HistoryStore | None = None
+_history_store_lock = threading.Lock()
+
 def generate_hex() -> str:
     """New token generation"""
     return secrets.token_hex(16)
@@ -11,3 +18,23 @@ def generate_hex() -> str:
 def get_session_history_with_local_file(session_id) -> FileChatMessageHistory:
     fpath = Settings.web.path_to_history + f"{session_id}.txt"
     return FileChatMessageHistory(file_path = fpath, encoding = "utf-8", ensure_ascii = False)
+
+def get_history_store() -> HistoryStore:
+    """Shared SQLite history store. It is opened on the first call"""
+    global _history_store
+    with _history_store_lock:
+        if _history_store is None:
+            _history_store = HistoryStore(Settings.web.path_to_history + Settings.web.history_db)
+    return _history_store
+
+def get_session_history_with_store(session_id) -> StoreChatMessageHistory:
+    return StoreChatMessageHistory(session_id = session_id, store = get_history_store())
+
+def get_session_history(session_id) -> BaseChatMessageHistory:
+    """Session history with the backend from the config (`web.history_backend`)"""
+    match Settings.web.history_backend:
+        case "sqlite":
+            return get_session_history_with_store(session_id)
+
+        case "file":
+            return get_session_history_with_local_file(session_id)
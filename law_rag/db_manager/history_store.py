@@ -0,0 +1,200 @@
+"""
+Chat history store on SQLite.
+
+`FileChatMessageHistory` re-reads and rewrites the whole JSON file on every message and never deletes it.
+Here every message is one appended row (SQLite in WAL mode), only the last messages of a session are read,
+they are kept in memory for the recently active sessions, and the sessions that were not active
+for `ttl` seconds are deleted.
+"""
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+from collections import OrderedDict, deque
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
+
+from law_rag.config import Settings
+
+from typing import Deque, List, Sequence
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """Histories of all sessions in one SQLite database
+
+    Parameters
+    ----------
+    path: str
+        Path to the database file
+    hot_window: int
+        Number of the last messages of the session that are given as it's history.
+        The older ones stay in the database, and the history window of the prompt never sees them
+    hot_sessions: int
+        Number of the sessions whose last messages are kept in memory.
+        The least recently used ones are read from the database again on the next message
+    ttl: float
+        Seconds of inactivity after which the session is deleted
+    gc_interval: float
+        Seconds between the garbage collections. It runs on the message append
+    """
+    def __init__(
+        self,
+        path: str,
+        hot_window: int = Settings.web.history_hot_window,
+        hot_sessions: int = Settings.web.history_hot_sessions,
+        ttl: float = Settings.web.history_ttl,
+        gc_interval: float = Settings.web.history_gc_interval
+    ) -> None:
+        self.hot_window = hot_window
+        self.hot_sessions = hot_sessions
+        self.ttl = ttl
+        self.gc_interval = gc_interval
+
+        Path(path).parent.mkdir(parents = True, exist_ok = True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread = False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        # With WAL it is still safe against the database corruption, only the last transactions could be lost
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                message TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_session ON messages (session_id, id);
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_active REAL NOT NULL,
+                size INTEGER NOT NULL
+            );
+        """)
+
+        # session id -> the last messages, in the least recently used order
+        self._hot: OrderedDict[str, Deque[BaseMessage]] = OrderedDict()
+        self._last_gc = time.time()
+
+    def _remember(self, session_id: str, messages: Deque[BaseMessage]) -> None:
+        """Keep the session in memory, forgetting the least recently used ones. Should be called under the lock"""
+        self._hot[session_id] = messages
+        self._hot.move_to_end(session_id)
+        while len(self._hot) > self.hot_sessions:
+            self._hot.popitem(last = False)
+
+    def _load(self, session_id: str) -> None:
+        """Put the last messages of the session to the memory, if it exists. Should be called under the lock"""
+        if session_id in self._hot:
+            self._hot.move_to_end(session_id)
+            return
+
+        row = self._connection.execute(
+            "SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        # New sessions are put to the memory only with the first message, so they are always seen by the GC
+        if row is None:
+            return
+
+        rows = self._connection.execute(
+            "SELECT message FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, self.hot_window)
+        ).fetchall()
+        messages = messages_from_dict([json.loads(message) for message, in reversed(rows)])
+
+        self._remember(session_id, deque(messages, maxlen = self.hot_window))
+
+    def get_messages(self, session_id: str) -> List[BaseMessage]:
+        """The last `hot_window` messages of the session"""
+        with self._lock:
+            self._load(session_id)
+            if session_id not in self._hot:
+                return []
+            return list(self._hot[session_id])
+
+    def append(self, session_id: str, messages: Sequence[BaseMessage]) -> None:
+        """Append the messages in one transaction"""
+        now = time.time()
+
+        with self._lock:
+            self._load(session_id)
+            with self._connection:
+                self._connection.executemany(
+                    "INSERT INTO messages (session_id, message) VALUES (?, ?)",
+                    [(session_id, json.dumps(message_to_dict(message), ensure_ascii = False)) for message in messages]
+                )
+                self._connection.execute(
+                    """
+                    INSERT INTO sessions (session_id, last_active, size) VALUES (?, ?, ?)
+                    ON CONFLICT (session_id) DO UPDATE SET last_active = excluded.last_active, size = size + excluded.size
+                    """,
+                    (session_id, now, len(messages))
+                )
+
+            if session_id not in self._hot:
+                self._remember(session_id, deque(maxlen = self.hot_window))
+            self._hot[session_id].extend(messages)
+
+            need_gc = now - self._last_gc >= self.gc_interval
+
+        if need_gc:
+            self.collect_garbage()
+
+    def clear(self, session_id: str) -> None:
+        with self._lock:
+            self._delete([session_id])
+
+    def _delete(self, session_ids: List[str]) -> None:
+        """Delete the sessions. Should be called under the lock"""
+        rows = [(session_id,) for session_id in session_ids]
+        with self._connection:
+            self._connection.executemany("DELETE FROM messages WHERE session_id = ?", rows)
+            self._connection.executemany("DELETE FROM sessions WHERE session_id = ?", rows)
+
+        for session_id in session_ids:
+            self._hot.pop(session_id, None)
+
+    def collect_garbage(self) -> int:
+        """Delete the sessions that were not active for `ttl` seconds
+
+        Returns
+        -------
+        deleted: int
+            Number of the deleted sessions
+        """
+        with self._lock:
+            self._last_gc = time.time()
+            rows = self._connection.execute(
+                "SELECT session_id FROM sessions WHERE last_active < ?", (self._last_gc - self.ttl,)
+            ).fetchall()
+            session_ids = [session_id for session_id, in rows]
+            if session_ids:
+                self._delete(session_ids)
+
+        if session_ids:
+            logger.info(f"{len(session_ids)} abandoned chat sessions were deleted")
+        return len(session_ids)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class StoreChatMessageHistory(BaseChatMessageHistory):
+    """History of one session in the `HistoryStore`"""
+    def __init__(self, session_id: str, store: HistoryStore) -> None:
+        self.session_id = session_id
+        self.store = store
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.get_messages(self.session_id)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        self.store.append(self.session_id, messages)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
@@ -1,32 +1,41 @@
 from law_rag.documents.common import load_pkl
-from law_rag.knowledge.db_connection import langchain_neo4j_connection, langchain_neo4j_vector
-from law_rag.knowledge.commands import (
-    delete_index,
-    delete_nodes,
-    holmes_nodes_creation
+from law_rag.knowledge.db_connection import (
+    check_connection,
+    langchain_neo4j_connection,
+    langchain_neo4j_vector
 )
+from law_rag.knowledge.bulk_ingestion import load_triplets
+from law_rag.knowledge.schema import apply_schema
+from law_rag.knowledge.reset import reset_graph
+from law_rag.knowledge.embedding_writer import write_embeddings
+from law_rag.knowledge.vector_index import create_vector_index
+from law_rag.knowledge.graph_version import bump_graph_version
+from law_rag.models.embeddings_wrapper import get_embeddings
 from law_rag.models.llm_wrapper import retriever_answer
+from law_rag.profiling import profile_run
 from law_rag.config import Settings
 
-from tqdm import tqdm
+import argparse
 from dotenv import load_dotenv
 
 
 def build_nodes():
     # Connect to Neo4j database instance
     graph = langchain_neo4j_connection()
+    driver = check_connection()
 
     # Clear Database
-    graph.query(delete_index("holmes"))
-    graph.query(delete_nodes("holmes"))
+    reset_graph(driver, "holmes")
 
     # Load file with nodes params
     triplets = load_pkl(Settings.documents.holmes_pickle)
 
-    # Create every triplet
-    for triplet in tqdm(triplets):
-        command = holmes_nodes_creation(triplet)
-        graph.query(command)
+    # Constraints for MERGE lookups by the Entity name
+    apply_schema(driver)
+
+    # Create every triplet, grouped by the relation type
+    load_triplets(driver, triplets)
+    driver.close()
     
     # Update graph schema
     graph.refresh_schema()
@@ -42,7 +51,20 @@ def build_embeddings():
         print(f"Model: {Settings.models.embeddings_model}")
         print("Please, wait...")
     
-    vector_graph = langchain_neo4j_vector("holmes")
+    # Fill in missing embeddings page by page
+    embeddings = get_embeddings()
+    driver = check_connection()
+    write_embeddings(driver, embeddings, "holmes")
+
+    # The index is created after the embeddings, so it is populated at once
+    create_vector_index(driver, "holmes")
+
+    # The graph was changed, so the API caches made with the old graph are invalid now
+    bump_graph_version(driver)
+    driver.close()
+
+    # The index exists and all nodes have embeddings now, so it only connects to it
+    vector_graph = langchain_neo4j_vector("holmes", embeddings)
 
     if not Settings.system.silent_creation:
         print("Embeddings was created and/or loaded")
@@ -59,5 +81,14 @@ def build_embeddings():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Build the Holmes Knowledge Graph from the triplets")
+    parser.add_argument(
+        "--profile",
+        action = "store_true",
+        help = "Write pstats, collapsed stacks and top memory allocations of the build to the profile folder"
+    )
+    args = parser.parse_args()
+
     load_dotenv()
-    build_nodes()
\ No newline at end of file
+    with profile_run("holmes_build_graph", enabled = args.profile):
+        build_nodes()
\ No newline at end of file
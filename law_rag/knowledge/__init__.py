@@ -4,4 +4,10 @@ This module contains functions to making the graph schema and add to Neo4j datab
 from . import db_connection
 from . import graph_building
 from . import commands
+from . import bulk_ingestion
+from . import schema
+from . import reset
+from . import embedding_writer
+from . import vector_index
+from . import graph_version
 from . import node_schema
\ No newline at end of file
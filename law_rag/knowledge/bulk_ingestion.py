@@ -0,0 +1,464 @@
+"""
+Bulk ingestion of the Codex hierarchy and the HOLMES triplets into Neo4j.
+
+Nodes and relationships are collected in `GraphBatch` first, and then written with a few
+parameterized `UNWIND $rows` commands per label, batch by batch in explicit transactions.
+
+Every node stores `content_hash` of it's parameters and `text_hash` of the embedded text,
+so `GraphBatch.write_incremental` can write only the difference with the graph.
+
+Triplets are grouped by the relation type and written by `load_triplets` in the same way.
+"""
+import re
+import json
+import time
+import hashlib
+
+from tqdm import tqdm
+
+from neo4j import Driver
+
+from law_rag.knowledge.node_schema import Node, get_parent_type
+from law_rag.knowledge.commands import (
+    bulk_create_nodes_command,
+    bulk_update_nodes_command,
+    bulk_delete_nodes_command,
+    node_hashes_command,
+    bulk_create_previous_relationship,
+    bulk_create_parent_relationship,
+    bulk_delete_previous_relationship,
+    bulk_delete_parent_relationship,
+    relationships_command,
+    bulk_holmes_nodes_creation,
+    bulk_holmes_nodes_creation_apoc
+)
+from law_rag.models.tokens import estimate_tokens
+from law_rag.config import Settings
+
+from typing import List, Dict, Tuple, Literal, Any
+
+# The order of writing, from top to bottom of the hierarchy
+HIERARCHY = ["Codex", "Article", "Paragraph", "Subparagraph"]
+
+# Parameters that are used to make the embeddings text
+EMBEDDED_PARAMETERS = ["text", "name"]
+# Parameters that are not the Node content
+SERVICE_PARAMETERS = ["number", "content_hash", "text_hash", "tokens", Settings.data.embeddings_parameter]
+
+
+def node_properties(node: Node) -> Dict[str, Any]:
+    """Node parameters that should be set in Neo4j
+
+    It is the same set of parameters that `create_node_command` sets:
+    without the primal key, without system parameters and without *None* values.
+    """
+    key_name, _ = node.primal_key()
+    do_not_set_params = node.system_parameters() + [key_name]
+
+    properties = {}
+    for param_name in node.all_parameters():
+        if param_name not in do_not_set_params:
+            param_value = getattr(node, param_name)
+            if param_value is not None:
+                properties[param_name] = param_value
+
+    return properties
+
+
+def content_hashes(properties: Dict[str, Any]) -> Tuple[str, str]:
+    """Hashes of all Node parameters and of the embedded text only
+
+    Returns
+    -------
+    content_hash: str
+        Hash of all parameters
+    text_hash: str
+        Hash of the parameters that are used for the embeddings
+    """
+    content = json.dumps(properties, sort_keys = True, ensure_ascii = False)
+    text = json.dumps([properties.get(name) for name in EMBEDDED_PARAMETERS], ensure_ascii = False)
+
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return content_hash, text_hash
+
+
+def batches(rows: List[Dict[str, Any]], batch_size: int) -> List[List[Dict[str, Any]]]:
+    """Split rows into batches of `batch_size` length"""
+    return [rows[i:i + batch_size] for i in range(0, len(rows), batch_size)]
+
+
+def run_in_batches(
+    driver: Driver,
+    command: str,
+    rows: List[Dict[str, Any]],
+    batch_size: int
+) -> None:
+    """Run the command for every batch of rows, every batch in it's own transaction"""
+    with driver.session() as session:
+        for batch in batches(rows, batch_size):
+            session.execute_write(lambda tx: tx.run(command, rows = batch).consume())
+
+
+class GraphBatch:
+    """Collection of the Codex hierarchy nodes and relationships for the bulk write
+
+    Methods mirror the single-node commands from `law_rag.knowledge.commands`:
+    - `add_node` - `create_node_command`
+    - `add_previous_relationship` - `create_previous_relationship`
+    - `add_parent_relationship` - `create_parent_relationship`
+
+    so the written graph is the same as the one made by them node by node.
+    """
+    def __init__(self) -> None:
+        # Node type -> Node key -> properties
+        self.nodes: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        # Node type -> rows
+        self.next_rows: Dict[str, List[Dict[str, str]]] = {}
+        # (Node type, parent type) -> rows
+        self.parent_rows: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
+
+    def add_node(self, node: Node) -> None:
+        _, key_value = node.primal_key()
+        # If the Node is added twice, it's parameters are updated like with MERGE + SET
+        properties = self.nodes.setdefault(node.type, {}).setdefault(key_value, {})
+        properties.update(node_properties(node))
+
+    def add_previous_relationship(self, node: Node) -> None:
+        # A Node could not have any previous Nodes because it is the first
+        if node.previous is None:
+            return
+
+        _, key_value = node.primal_key()
+        self.next_rows.setdefault(node.type, []).append({"key": key_value, "previous": node.previous})
+
+    def add_parent_relationship(self, node: Node) -> None:
+        if node.parent is None:
+            return
+
+        _, key_value = node.primal_key()
+        parent_type = get_parent_type(node)
+        self.parent_rows.setdefault((node.type, parent_type), []).append({"key": key_value, "parent": node.parent})
+
+    def __len__(self) -> int:
+        return sum(len(nodes) for nodes in self.nodes.values())
+
+    def node_rows(self, node_type: str) -> List[Dict[str, Any]]:
+        """Rows for the bulk commands: Node key and parameters with the content hashes and the text token count"""
+        rows = []
+        for key, properties in self.nodes.get(node_type, {}).items():
+            content_hash, text_hash = content_hashes(properties)
+            rows.append({
+                "key": key,
+                "properties": {
+                    **properties,
+                    "content_hash": content_hash,
+                    "text_hash": text_hash,
+                    # For the context packing at the question time
+                    "tokens": estimate_tokens(properties.get("text") or "")
+                }
+            })
+        return rows
+
+    def relationship_keys(self, node_type: str) -> set[str]:
+        """Keys of the Nodes of this type that relationships are pointed to"""
+        keys = set()
+        for row in self.next_rows.get(node_type, []):
+            keys.update([row["key"], row["previous"]])
+
+        for (child_type, parent_type), rows in self.parent_rows.items():
+            if child_type == node_type:
+                keys.update(row["key"] for row in rows)
+            if parent_type == node_type:
+                keys.update(row["parent"] for row in rows)
+
+        return keys
+
+    def write_relationships(self, driver: Driver, batch_size: int) -> None:
+        """Write all collected relationships. MERGE makes it safe to write existing ones again"""
+        for node_type, rows in self.next_rows.items():
+            run_in_batches(driver, bulk_create_previous_relationship(node_type), rows, batch_size)
+
+        for (node_type, parent_type), rows in self.parent_rows.items():
+            run_in_batches(driver, bulk_create_parent_relationship(node_type, parent_type), rows, batch_size)
+
+    def delete_stale_relationships(self, driver: Driver, batch_size: int) -> int:
+        """Delete `NEXT` and `PART_OF` relationships of the graph that are not collected anymore
+
+        MERGE does not remove anything, so without it an inserted Node (e.g. article 10.1)
+        would leave the old 10 -> 11 `NEXT` relationship next to the new 10 -> 10.1 -> 11 chain.
+
+        Returns
+        -------
+        deleted: int
+            Number of deleted relationships
+        """
+        expected_next = {
+            node_type: {(row["previous"], row["key"]) for row in rows}
+            for node_type, rows in self.next_rows.items()
+        }
+        expected_parent = {
+            types: {(row["key"], row["parent"]) for row in rows}
+            for types, rows in self.parent_rows.items()
+        }
+
+        stale_next: Dict[str, List[Dict[str, str]]] = {}
+        stale_parent: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
+        for node_type in HIERARCHY:
+            records, _, _ = driver.execute_query(relationships_command(node_type))
+            for record in records:
+                match record["relation"]:
+                    case "NEXT":
+                        if (record["key"], record["other"]) not in expected_next.get(node_type, set()):
+                            stale_next.setdefault(node_type, []).append(
+                                {"key": record["other"], "previous": record["key"]}
+                            )
+                    case "PART_OF":
+                        types = (node_type, record["other_type"])
+                        if (record["key"], record["other"]) not in expected_parent.get(types, set()):
+                            stale_parent.setdefault(types, []).append(
+                                {"key": record["key"], "parent": record["other"]}
+                            )
+
+        for node_type, rows in stale_next.items():
+            run_in_batches(driver, bulk_delete_previous_relationship(node_type), rows, batch_size)
+
+        for (node_type, parent_type), rows in stale_parent.items():
+            run_in_batches(driver, bulk_delete_parent_relationship(node_type, parent_type), rows, batch_size)
+
+        return sum(len(rows) for rows in stale_next.values()) + sum(len(rows) for rows in stale_parent.values())
+
+    def write(self, driver: Driver, batch_size: int = Settings.build.batch_size) -> None:
+        """Write all collected nodes and relationships to Neo4j
+
+        Arguments
+        ---------
+        driver: neo4j.Driver
+            Driver to the neo4j database
+        batch_size: int
+            Number of rows in one transaction
+        """
+        start = time.perf_counter()
+
+        # Nodes
+        for node_type in HIERARCHY:
+            run_in_batches(driver, bulk_create_nodes_command(node_type), self.node_rows(node_type), batch_size)
+
+        # Relationships
+        self.write_relationships(driver, batch_size)
+
+        if not Settings.system.silent_creation:
+            elapsed = time.perf_counter() - start
+            relationships = sum(len(rows) for rows in self.next_rows.values())
+            relationships += sum(len(rows) for rows in self.parent_rows.values())
+            print(f"{len(self)} nodes and {relationships} relationships were written in {elapsed:.2f} s")
+
+
+    def write_incremental(self, driver: Driver, batch_size: int = Settings.build.batch_size) -> Dict[str, int]:
+        """Write only the difference between collected nodes and the graph
+
+        - Nodes with a new `content_hash` are written. If their `text_hash` is changed too,
+        their embeddings are removed, so only they will be embedded again
+        - Nodes that are not collected anymore (and relationships do not point to them) are deleted
+        - Relationships that are not collected anymore are deleted, the others are merged again,
+        so the graph is the same as after the full rebuild
+
+        Arguments
+        ---------
+        driver: neo4j.Driver
+            Driver to the neo4j database
+        batch_size: int
+            Number of rows in one transaction
+
+        Returns
+        -------
+        stats: Dict[str, int]
+            Number of added, updated, re-embedded, deleted and unchanged nodes and of deleted relationships
+        """
+        start = time.perf_counter()
+        stats = {
+            "added": 0, "updated": 0, "text_changed": 0, "deleted": 0, "unchanged": 0, "relationships_deleted": 0
+        }
+
+        for node_type in HIERARCHY:
+            records, _, _ = driver.execute_query(node_hashes_command(node_type))
+            existing = {record["key"]: record for record in records}
+
+            changed_rows = []
+            for row in self.node_rows(node_type):
+                record = existing.get(row["key"])
+                properties = row["properties"]
+
+                if record is None:
+                    stats["added"] += 1
+                    changed_rows.append({**row, "text_changed": False})
+
+                elif record["content_hash"] != properties["content_hash"]:
+                    text_changed = record["text_hash"] != properties["text_hash"]
+                    stats["updated"] += 1
+                    stats["text_changed"] += int(text_changed)
+
+                    # Parameters that the Node does not have anymore
+                    removed = {
+                        name: None for name in record["properties"]
+                        if name not in properties and name not in SERVICE_PARAMETERS
+                    }
+                    changed_rows.append({
+                        "key": row["key"],
+                        "properties": {**removed, **properties},
+                        "text_changed": text_changed
+                    })
+
+                else:
+                    stats["unchanged"] += 1
+
+            run_in_batches(driver, bulk_update_nodes_command(node_type), changed_rows, batch_size)
+
+            # Vanished nodes
+            expected = set(self.nodes.get(node_type, {})) | self.relationship_keys(node_type)
+            vanished = [{"key": key} for key in existing if key not in expected]
+            stats["deleted"] += len(vanished)
+            run_in_batches(driver, bulk_delete_nodes_command(node_type), vanished, batch_size)
+
+        stats["relationships_deleted"] = self.delete_stale_relationships(driver, batch_size)
+        self.write_relationships(driver, batch_size)
+
+        if not Settings.system.silent_creation:
+            elapsed = time.perf_counter() - start
+            print(
+                f"Graph was updated in {elapsed:.2f} s: {stats['added']} added, {stats['updated']} updated "
+                f"({stats['text_changed']} need new embeddings), {stats['deleted']} deleted, {stats['unchanged']} unchanged, "
+                f"{stats['relationships_deleted']} stale relationships deleted"
+            )
+
+        return stats
+
+
+# --------
+#  HOLMES
+# --------
+
+def normalize_relation(relation: str) -> str:
+    """Make a relation type suitable for Neo4j
+
+    It is the same fix as in `triplets_generation.fix_generation_issues`,
+    and every other symbol that is not a letter, a digit or "_" is removed too.
+    """
+    relation = re.sub(r"[\s/-]", "_", relation)
+    relation = re.sub(r"[^\w]", "", relation)
+    return relation.upper()
+
+
+def group_triplets(triplets: List[Dict[str, str]]) -> Tuple[Dict[str, List[Dict[str, str]]], int]:
+    """Group triplets by the normalized relation type
+
+    Triplets without string subject, relation or object are skipped.
+
+    Returns
+    -------
+    groups: Dict[str, List[Dict[str, str]]]
+        Relation type -> rows with `subject` and `object` fields
+    skipped: int
+        Number of skipped triplets
+    """
+    groups: Dict[str, List[Dict[str, str]]] = {}
+    skipped = 0
+
+    for triplet in triplets:
+        try:
+            subject, relation, obj = triplet["subject"], triplet["relation"], triplet["object"]
+        except (TypeError, KeyError):
+            skipped += 1
+            continue
+
+        if not all(type(value) is str and value for value in [subject, relation, obj]):
+            skipped += 1
+            continue
+
+        relation = normalize_relation(relation)
+        if not relation:
+            skipped += 1
+            continue
+
+        groups.setdefault(relation, []).append({"subject": subject, "object": obj})
+
+    return groups, skipped
+
+
+def _run_many(tx, work: List[Tuple[str, List[Dict[str, str]]]]) -> None:
+    for command, rows in work:
+        tx.run(command, rows = rows).consume()
+
+
+def load_triplets(
+    driver: Driver,
+    triplets: List[Dict[str, str]],
+    batch_size: int = Settings.build.batch_size,
+    loader: Literal["unwind", "apoc"] = Settings.build.holmes_loader
+) -> None:
+    """Write HOLMES triplets to Neo4j in a few transactions
+
+    Arguments
+    ---------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    triplets: List[Dict[str, str]]
+        Triplets with `subject`, `relation` and `object` fields
+    batch_size: int
+        Number of triplets in one transaction
+    loader: Literal["unwind", "apoc"]
+        - **unwind**: one `UNWIND` command per relation type.
+        Commands of different relation types share the transaction until it has `batch_size` triplets
+        - **apoc**: one `UNWIND` command for all relation types with `apoc.merge.relationship`
+    """
+    start = time.perf_counter()
+    groups, skipped = group_triplets(triplets)
+    total = sum(len(rows) for rows in groups.values())
+
+    progress = tqdm(total = total, disable = Settings.system.silent_creation)
+    transactions = 0
+
+    with driver.session() as session:
+        match loader:
+            case "unwind":
+                work: List[Tuple[str, List[Dict[str, str]]]] = []
+                work_rows = 0
+
+                for relation, rows in groups.items():
+                    for batch in batches(rows, batch_size):
+                        work.append((bulk_holmes_nodes_creation(relation), batch))
+                        work_rows += len(batch)
+
+                        if work_rows >= batch_size:
+                            session.execute_write(_run_many, work)
+                            transactions += 1
+                            progress.update(work_rows)
+                            work, work_rows = [], 0
+
+                if work:
+                    session.execute_write(_run_many, work)
+                    transactions += 1
+                    progress.update(work_rows)
+
+            case "apoc":
+                rows = [
+                    {"subject": row["subject"], "relation": relation, "object": row["object"]}
+                    for relation, relation_rows in groups.items()
+                    for row in relation_rows
+                ]
+                command = bulk_holmes_nodes_creation_apoc()
+                for batch in batches(rows, batch_size):
+                    session.execute_write(_run_many, [(command, batch)])
+                    transactions += 1
+                    progress.update(len(batch))
+
+    progress.close()
+
+    if not Settings.system.silent_creation:
+        elapsed = time.perf_counter() - start
+        print(
+            f"{total} triplets of {len(groups)} relation types were written "
+            f"in {transactions} transactions, {elapsed:.2f} s ({total / max(elapsed, 1e-9):.0f} triplets/s)"
+        )
+        if skipped:
+            print(f"{skipped} broken triplets were skipped")
@@ -77,6 +77,71 @@ def delete_nodes(
     
     return command
 
+def _match_nodes_to_delete(
+    mode: Literal["all", "naive", "holmes"] = "all",
+    codex: str | None = None
+) -> str:
+    match mode:
+        case "all":
+            command = "MATCH (n)\n"
+
+        case "naive":
+            command = "MATCH (n:Codex|Article|Paragraph|Subparagraph)\n"
+        
+        case "holmes":
+            command = f"MATCH (n:{Settings.data.holmes_node})\n"
+    
+    # Numbers of all Nodes of the Codex start with the Codex number
+    if codex is not None:
+        command += 'WHERE n.number = $codex OR n.number STARTS WITH $codex + "."\n'
+
+    return command
+
+def count_nodes_to_delete(
+    mode: Literal["all", "naive", "holmes"] = "all",
+    codex: str | None = None
+) -> str:
+    """A Cypher command to count nodes that `delete_nodes_in_transactions` will delete"""
+    command = _match_nodes_to_delete(mode, codex)
+    command += "RETURN count(n) AS total"
+    return command
+
+def delete_nodes_in_transactions(
+    mode: Literal["all", "naive", "holmes"] = "all",
+    codex: str | None = None
+) -> str:
+    """A Cypher command to delete a chunk of nodes (with their relationships) in many small transactions
+
+    Needs `$limit` (number of nodes in this chunk), `$batch_size` (number of nodes in one transaction)
+    and `$codex` (if `codex` argument is set) parameters.  
+    It should be run in an auto-commit transaction and repeated until it returns 0.
+    
+    Command:
+    ```Cypher
+    MATCH (n)
+    WITH n LIMIT $limit
+    CALL (n) {
+        DETACH DELETE n
+    } IN TRANSACTIONS OF $batch_size ROWS
+    RETURN count(n) AS deleted
+    ```
+
+    Arguments
+    ---------
+    mode: Literal["all", "naive", "holmes"] = "all"
+        What nodes to delete
+    codex: str | None = None
+        Delete only the nodes of this Codex (Codex Node itself, Articles, Paragraphs and Subparagraphs)
+    """
+    command = _match_nodes_to_delete(mode, codex)
+    command += """WITH n LIMIT $limit
+    CALL (n) {
+        DETACH DELETE n
+    } IN TRANSACTIONS OF $batch_size ROWS
+    RETURN count(n) AS deleted
+    """
+    return command
+
 def create_node_command(node: Node) -> str:
     """Returns a whole command to create a Node with nessasary parameters
     
@@ -169,6 +234,169 @@ def create_parent_relationship(node: Node) -> str:
     
     return command
 
+# ----------------------
+# Bulk creation commands
+# ----------------------
+# Labels could not be parameterized, but there are only few of them,
+# so Neo4j caches the plan of every command and reuses it for every batch of rows
+
+def bulk_create_nodes_command(node_type: str, key_name: str = "number") -> str:
+    """A command to create (or update) many Nodes of the same type at once
+    
+    Needs `$rows` parameter - list of dicts with `key` and `properties` fields.
+
+    The command will be based on this schema:
+    ```Cypher
+    UNWIND $rows AS row
+    MERGE (n:<type_of_node> {<key_name>: row.key})
+    SET n += row.properties
+    ```
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (n:{node_type} {{{key_name}: row.key}})
+    SET n += row.properties
+    """
+    return command
+
+def bulk_update_nodes_command(node_type: str, key_name: str = "number") -> str:
+    """A command to update many Nodes of the same type at once and remove embeddings of the changed texts
+    
+    Needs `$rows` parameter - list of dicts with `key`, `properties` and `text_changed` fields.  
+    Properties with *null* values are removed from the Node.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (n:{node_type} {{{key_name}: row.key}})
+    SET n += row.properties
+    WITH n, row
+    WHERE row.text_changed
+    REMOVE n.{Settings.data.embeddings_parameter}
+    """
+    return command
+
+def node_hashes_command(node_type: str, key_name: str = "number") -> str:
+    """A command to get the content hashes and parameters names of all Nodes of the type"""
+    command = f"""
+    MATCH (n:{node_type})
+    RETURN n.{key_name} AS key, n.content_hash AS content_hash, n.text_hash AS text_hash, keys(n) AS properties
+    """
+    return command
+
+def bulk_delete_nodes_command(node_type: str, key_name: str = "number") -> str:
+    """A command to delete many Nodes of the same type (with their relationships) at once
+    
+    Needs `$rows` parameter - list of dicts with `key` field.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MATCH (n:{node_type} {{{key_name}: row.key}})
+    DETACH DELETE n
+    """
+    return command
+
+def bulk_create_previous_relationship(node_type: str, key_name: str = "number") -> str:
+    """A command to create many `NEXT` relationships between Nodes of the same type at once
+    
+    Needs `$rows` parameter - list of dicts with `key` and `previous` fields.
+
+    The command will be based on this schema:
+    ```Cypher
+    UNWIND $rows AS row
+    MERGE (n:<type_of_node> {<key_name>: row.key})
+    MERGE (n_prev:<type_of_node> {<key_name>: row.previous})
+    MERGE (n_prev)-[r:NEXT]->(n)
+    ```
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (n:{node_type} {{{key_name}: row.key}})
+    MERGE (n_prev:{node_type} {{{key_name}: row.previous}})
+    MERGE (n_prev)-[r:NEXT]->(n)
+    """
+    return command
+
+def bulk_create_parent_relationship(
+    node_type: str,
+    parent_type: str,
+    key_name: str = "number"
+) -> str:
+    """A command to create many `PART_OF` relationships to the higher on hierarchy nodes at once
+    
+    Needs `$rows` parameter - list of dicts with `key` and `parent` fields.
+
+    The command will be based on this schema:
+    ```Cypher
+    UNWIND $rows AS row
+    MERGE (n:<type_of_node> {<key_name>: row.key})
+    MERGE (n_p:<parent_type_of_node> {<key_name>: row.parent})
+    MERGE (n)-[r:PART_OF]->(n_p)
+    ```
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (n:{node_type} {{{key_name}: row.key}})
+    MERGE (n_p:{parent_type} {{{key_name}: row.parent}})
+    MERGE (n)-[r:PART_OF]->(n_p)
+    """
+    return command
+
+def relationships_command(node_type: str, key_name: str = "number") -> str:
+    """A command to get all outgoing `NEXT` and `PART_OF` relationships of the Nodes of the type
+
+    Every row has `relation`, `key` (of the start Node), `other` (key of the end Node) and `other_type` fields.
+    """
+    command = f"""
+    MATCH (n:{node_type})-[r:NEXT|PART_OF]->(other)
+    RETURN type(r) AS relation, n.{key_name} AS key, other.{key_name} AS other, labels(other)[0] AS other_type
+    """
+    return command
+
+def bulk_delete_previous_relationship(node_type: str, key_name: str = "number") -> str:
+    """A command to delete many `NEXT` relationships between Nodes of the same type at once
+
+    Needs `$rows` parameter - list of dicts with `key` and `previous` fields.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MATCH (n_prev:{node_type} {{{key_name}: row.previous}})-[r:NEXT]->(n:{node_type} {{{key_name}: row.key}})
+    DELETE r
+    """
+    return command
+
+def bulk_delete_parent_relationship(
+    node_type: str,
+    parent_type: str,
+    key_name: str = "number"
+) -> str:
+    """A command to delete many `PART_OF` relationships to the higher on hierarchy nodes at once
+
+    Needs `$rows` parameter - list of dicts with `key` and `parent` fields.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MATCH (n:{node_type} {{{key_name}: row.key}})-[r:PART_OF]->(n_p:{parent_type} {{{key_name}: row.parent}})
+    DELETE r
+    """
+    return command
+
+# ------
+# Schema
+# ------
+
+def create_unique_constraint_command(name: str, label: str, property_name: str) -> str:
+    """A command to create a uniqueness constraint (and it's backing range index) if it does not exist"""
+    command = f"CREATE CONSTRAINT `{name}` IF NOT EXISTS FOR (n:{label}) REQUIRE n.{property_name} IS UNIQUE"
+    return command
+
+def show_constraints_command() -> str:
+    command = "SHOW CONSTRAINTS YIELD name, type, labelsOrTypes, properties"
+    return command
+
+def show_indexes_command() -> str:
+    command = "SHOW INDEXES YIELD name, type, labelsOrTypes, properties, state"
+    return command
+
 # Because there are no variants to create a vector index in Neo4j for multiple labels, we unite this labels
 # https://stackoverflow.com/questions/79578894/can-i-create-one-vector-index-for-multiple-labels-e-g-movie-and-person
 def create_embeddings_label(
@@ -182,26 +410,107 @@ def create_embeddings_label(
     """
     return command
 
-def create_index_embeddings() -> str:
-    """
-    (!NB) Need a
+def create_index_embeddings(
+    index_name: str,
+    node_label: str,
+    embeddings_parameter: str,
+    index_config: Dict[str, int | str | bool]
+) -> str:
+    """A command to create a vector index if it does not exist
+
+    Labels and index options could not be parameterized, so they are set in the command itself.
+
+    The command will be based on this schema:
+    ```Cypher
+    CREATE VECTOR INDEX `<index_name>` IF NOT EXISTS
+    FOR (n:<node_label>) ON (n.<embeddings_parameter>)
+    OPTIONS {indexConfig: {`vector.dimensions`: 1024, ...}}
+    ```
 
-    - NodeLabel
-    - dimension
-    - similarity
-    - embeddingsParameter
+    Arguments
+    ---------
+    index_name: str
+        Name of the index
+    node_label: str
+        Label of the nodes with embeddings
+    embeddings_parameter: str
+        Node parameter with embeddings
+    index_config: Dict[str, int | str | bool]
+        Index settings, like {"vector.dimensions": 1024, "vector.similarity_function": "cosine"}
+    """
+    config_items = []
+    for name, value in index_config.items():
+        match value:
+            case bool():
+                value = "true" if value else "false"
+            case str():
+                value = f"'{value}'"
+        config_items.append(f"`{name}`: {value}")
 
-    params to execute!
+    command = f"""
+    CREATE VECTOR INDEX `{index_name}` IF NOT EXISTS
+    FOR (n:`{node_label}`) ON (n.{embeddings_parameter})
+    OPTIONS {{
+        indexConfig: {{
+            {", ".join(config_items)}
+        }}
+    }}
     """
+    return command
+
+def show_vector_index_command() -> str:
+    """A command to get the vector index state. Needs `$name` parameter"""
     command = """
-    CREATE VECTOR INDEX `node-embeddings` IF NOT EXISTS
-    FOR (a:$NodeLabel) ON (a.$embeddingsParameter)
-    OPTIONS {
-        indexConfig: {
-            `vector.dimensions`: $dimension,
-            `vector.similarity_function`: $similarity
-        }
-    }
+    SHOW VECTOR INDEXES
+    YIELD name, state, populationPercent, labelsOrTypes, properties, options
+    WHERE name = $name
+    RETURN name, state, populationPercent, labelsOrTypes, properties, options
+    """
+    return command
+
+def count_nodes_with_embeddings(node_label: str) -> str:
+    command = f"""
+    MATCH (n:`{node_label}`)
+    WHERE n.{Settings.data.embeddings_parameter} IS NOT NULL
+    RETURN count(n) AS total
+    """
+    return command
+
+def fetch_nodes_without_embeddings(node_label: str) -> str:
+    """A command to get the next page of nodes without embeddings
+
+    Needs `$props` (parameters that make the text) and `$limit` parameters.  
+    The text is made the same way as `Neo4jVector.from_existing_graph` does.
+    """
+    command = f"""
+    MATCH (n:`{node_label}`)
+    WHERE n.{Settings.data.embeddings_parameter} IS NULL
+    AND any(k IN $props WHERE n[k] IS NOT NULL)
+    RETURN elementId(n) AS id, reduce(str = '', k IN $props | str + '\\n' + k + ':' + coalesce(n[k], '')) AS text
+    LIMIT $limit
+    """
+    return command
+
+def count_nodes_without_embeddings(node_label: str) -> str:
+    """A command to count nodes without embeddings. Needs `$props` parameter"""
+    command = f"""
+    MATCH (n:`{node_label}`)
+    WHERE n.{Settings.data.embeddings_parameter} IS NULL
+    AND any(k IN $props WHERE n[k] IS NOT NULL)
+    RETURN count(n) AS total
+    """
+    return command
+
+def bulk_set_embeddings_command() -> str:
+    """A command to write many embeddings vectors at once
+
+    Needs `$rows` parameter - list of dicts with `id` (elementId of the node) and `embedding` fields.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MATCH (n)
+    WHERE elementId(n) = row.id
+    CALL db.create.setNodeVectorProperty(n, '{Settings.data.embeddings_parameter}', row.embedding)
     """
     return command
 
@@ -219,12 +528,65 @@ def holmes_nodes_creation(entity: Dict[str, str]) -> str:
     command += f"MERGE (s) -[r:{entity["relation"]}]->(o)"
     return command
 
+def bulk_holmes_nodes_creation(relation: str) -> str:
+    """A command to create many triplets with the same relation type at once
+
+    Relation type could not be parameterized, so there is one command per relation type.  
+    Needs `$rows` parameter - list of dicts with `subject` and `object` fields.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (s:{Settings.data.holmes_node} {{name: row.subject}})
+    MERGE (o:{Settings.data.holmes_node} {{name: row.object}})
+    MERGE (s)-[r:`{relation}`]->(o)
+    """
+    return command
+
+def bulk_holmes_nodes_creation_apoc() -> str:
+    """A command to create many triplets of any relation types at once with APOC
+
+    Needs `$rows` parameter - list of dicts with `subject`, `relation` and `object` fields.
+    """
+    command = f"""
+    UNWIND $rows AS row
+    MERGE (s:{Settings.data.holmes_node} {{name: row.subject}})
+    MERGE (o:{Settings.data.holmes_node} {{name: row.object}})
+    WITH s, o, row
+    CALL apoc.merge.relationship(s, row.relation, {{}}, {{}}, o, {{}}) YIELD rel
+    RETURN count(rel)
+    """
+    return command
+
+def bump_graph_version_command() -> str:
+    """A command to set a new random graph version. Caches made with the old version become invalid"""
+    command = """
+    MERGE (v:GraphVersion {name: "graph"})
+    SET v.version = randomUUID(), v.updated = datetime()
+    RETURN v.version AS version
+    """
+    return command
+
+def get_graph_version_command() -> str:
+    command = """
+    OPTIONAL MATCH (v:GraphVersion {name: "graph"})
+    RETURN v.version AS version
+    """
+    return command
+
 # --------------
 # Retrieval part
 # --------------
 
 # https://medium.com/neo4j/implementing-rag-how-to-write-a-graph-retrieval-query-in-langchain-74abf13044f2
 def retrieval_query() -> str:
+    """Retrieval query for the Codex hierarchy nodes
+
+    Besides the joined `text`, the metadata has the separate parts of the answer
+    (`document`, `prev`, `next` and `inner`, every one with the chunk `number`, `text` and `tokens`),
+    so the context could be deduplicated and packed to the token budget.
+    Every part has also the `article` number of the Article node it belongs to, because the chunk number
+    alone does not tell article "10.1" from paragraph 1 of article 10.
+    """
     command = """
     WITH node AS doc, score as similarity
     ORDER BY similarity DESC LIMIT 5
@@ -232,7 +594,15 @@ def retrieval_query() -> str:
         OPTIONAL MATCH (doc)<-[:PART_OF]-(inner:Paragraph|Subparagraph)
         OPTIONAL MATCH (prevDoc:Paragraph|Subparagraph)-[:NEXT]->(doc)
         OPTIONAL MATCH (doc)-[:NEXT]->(nextDoc:Paragraph|Subparagraph)
-        RETURN prevDoc, doc AS document, nextDoc, collect(inner.text) AS innerPart
+        RETURN
+            prevDoc,
+            doc AS document,
+            nextDoc,
+            collect(inner.text) AS innerPart,
+            collect(CASE WHEN inner IS NULL THEN null ELSE {
+                number: inner.number, text: inner.text, tokens: inner.tokens,
+                article: head([(inner)-[:PART_OF*0..2]->(article:Article) | article.number])
+            } END) AS innerParts
     }
     RETURN 
         coalesce(prevDoc.text + '\n', '') +
@@ -240,7 +610,22 @@ def retrieval_query() -> str:
         coalesce(reduce(acc = '\n', item IN innerPart | acc || item || '\n'), '') +
         coalesce(nextDoc.text, '') as text,
         similarity as score,
-        {source: document.number} AS metadata
+        {
+            source: document.number,
+            document: {
+                number: document.number, text: document.text, tokens: document.tokens,
+                article: head([(document)-[:PART_OF*0..2]->(article:Article) | article.number])
+            },
+            prev: CASE WHEN prevDoc IS NULL THEN null ELSE {
+                number: prevDoc.number, text: prevDoc.text, tokens: prevDoc.tokens,
+                article: head([(prevDoc)-[:PART_OF*0..2]->(article:Article) | article.number])
+            } END,
+            next: CASE WHEN nextDoc IS NULL THEN null ELSE {
+                number: nextDoc.number, text: nextDoc.text, tokens: nextDoc.tokens,
+                article: head([(nextDoc)-[:PART_OF*0..2]->(article:Article) | article.number])
+            } END,
+            inner: innerParts
+        } AS metadata
     """
     return command
 
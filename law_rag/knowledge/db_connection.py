@@ -10,6 +10,7 @@ from law_rag.models.embeddings_wrapper import get_embeddings
 from law_rag.knowledge.commands import retrieval_query, holmes_retrieval_query
 from law_rag.config import Settings
 
+from langchain_core.embeddings import Embeddings
 from typing import Literal
 
 from dotenv import load_dotenv
@@ -44,8 +45,13 @@ def check_connection() -> Driver:
         raise Exception(e)
 
 
-def langchain_neo4j_connection() -> Neo4jGraph:
+def langchain_neo4j_connection(refresh_schema: bool = True) -> Neo4jGraph:
     """Make the connection to Neo4j Database with Langchain_neo4j plagin
+
+    Arguments
+    ---------
+    refresh_schema: bool = True
+        Read the graph schema at the connection. It is not needed if the graph is used only for the vector stores
     
     Returns
     -------
@@ -61,7 +67,8 @@ def langchain_neo4j_connection() -> Neo4jGraph:
     graph = Neo4jGraph(
         url = Settings.system.neo4j_base_url,
         username = os.environ["DB_NAME"],
-        password = os.environ["DB_PASSWORD"]
+        password = os.environ["DB_PASSWORD"],
+        refresh_schema = refresh_schema
     )
 
     # Check the connection. If successful, return graph instance
@@ -76,15 +83,41 @@ def langchain_neo4j_connection() -> Neo4jGraph:
 
 
 # https://python.langchain.com/docs/integrations/vectorstores/neo4jvector/
-def langchain_neo4j_vector(mode: Literal["naive", "holmes"]) -> Neo4jVector:
+def langchain_neo4j_vector(
+    mode: Literal["naive", "holmes"],
+    embeddings: Embeddings | None = None,
+    graph: Neo4jGraph | None = None
+) -> Neo4jVector:
+    """Make the vector store over the graph nodes
+
+    Arguments
+    ---------
+    mode: Literal["naive", "holmes"]
+        Codex hierarchy nodes or HOLMES Entity nodes
+    embeddings: Embeddings | None = None
+        Already loaded embeddings model. If it is *None*, the model from the config is loaded
+    graph: Neo4jGraph | None = None
+        Connection whose driver the vector store uses. The caller closes it with `graph.close()`.
+        If it is *None*, the vector store opens it's own driver
+    """
+    if embeddings is None:
+        embeddings = get_embeddings()
+
+    if graph is not None:
+        connection = {"graph": graph}
+    else:
+        connection = {
+            "url": Settings.system.neo4j_base_url,
+            "username": os.environ["DB_NAME"],
+            "password": os.environ["DB_PASSWORD"]
+        }
+
     match mode:
         case "naive":
             vector_graph = Neo4jVector.from_existing_graph(
-                embedding = get_embeddings(),
+                embedding = embeddings,
 
-                url = Settings.system.neo4j_base_url,
-                username = os.environ["DB_NAME"],
-                password = os.environ["DB_PASSWORD"],
+                **connection,
 
                 index_name = Settings.data.index_name,
                 node_label = Settings.data.embeddings_label,
@@ -97,11 +130,9 @@ def langchain_neo4j_vector(mode: Literal["naive", "holmes"]) -> Neo4jVector:
         
         case "holmes":
             vector_graph = Neo4jVector.from_existing_graph(
-                embedding = get_embeddings(),
+                embedding = embeddings,
 
-                url = Settings.system.neo4j_base_url,
-                username = os.environ["DB_NAME"],
-                password = os.environ["DB_PASSWORD"],
+                **connection,
 
                 index_name = Settings.data.holmes_index_name,
                 node_label = Settings.data.holmes_node,
@@ -0,0 +1,116 @@
+"""
+Embeddings stage of the graph build.
+
+Nodes without embeddings are streamed from Neo4j page by page, embedded in large batches
+and written back with `db.create.setNodeVectorProperty`. Every page is written in it's own transaction,
+and the next page is the next nodes that still have no embeddings, so the graph itself is the checkpoint:
+if the build crashes, the next run continues from the nodes that were not written yet.
+
+You can run this .py file to fill in missing embeddings of the naive and holmes nodes.
+"""
+import time
+
+from neo4j import Driver
+from tqdm import tqdm
+
+from langchain_core.embeddings import Embeddings
+
+from law_rag.knowledge.commands import (
+    fetch_nodes_without_embeddings,
+    count_nodes_without_embeddings,
+    bulk_set_embeddings_command
+)
+from law_rag.config import Settings
+
+from typing import List, Dict, Tuple, Literal
+
+
+def embeddings_target(mode: Literal["naive", "holmes"]) -> Tuple[str, List[str]]:
+    """Node label and parameters that make the text to embed
+
+    They are the same as in `db_connection.langchain_neo4j_vector`
+    """
+    match mode:
+        case "naive":
+            return Settings.data.embeddings_label, ["text", "name"]
+
+        case "holmes":
+            return Settings.data.holmes_node, ["name"]
+
+
+def write_embeddings(
+    driver: Driver,
+    embeddings: Embeddings,
+    mode: Literal["naive", "holmes"],
+    batch_size: int = Settings.build.embeddings_batch_size
+) -> Dict[str, float]:
+    """Embed all nodes without embeddings and write the vectors to the graph
+
+    Arguments
+    ---------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    embeddings: Embeddings
+        Embeddings model
+    mode: Literal["naive", "holmes"]
+        Which nodes to embed
+    batch_size: int
+        Number of nodes in one page (one `embed_documents` call and one write transaction)
+
+    Returns
+    -------
+    stats: Dict[str, float]
+        Number of written nodes, elapsed seconds and nodes per second
+    """
+    label, props = embeddings_target(mode)
+    fetch_command = fetch_nodes_without_embeddings(label)
+    write_command = bulk_set_embeddings_command()
+
+    records, _, _ = driver.execute_query(count_nodes_without_embeddings(label), props = props)
+    total = records[0]["total"]
+
+    start = time.perf_counter()
+    written = 0
+
+    with tqdm(total = total, desc = label, disable = Settings.system.silent_creation) as progress:
+        while True:
+            records, _, _ = driver.execute_query(fetch_command, props = props, limit = batch_size)
+            if not records:
+                break
+
+            vectors = embeddings.embed_documents([record["text"] for record in records])
+            rows = [
+                {"id": record["id"], "embedding": vector}
+                for record, vector in zip(records, vectors)
+            ]
+            driver.execute_query(write_command, rows = rows)
+
+            written += len(rows)
+            progress.update(len(rows))
+
+    elapsed = time.perf_counter() - start
+    stats = {
+        "nodes": written,
+        "seconds": elapsed,
+        "nodes_per_second": written / elapsed if elapsed > 0 else 0.0
+    }
+
+    if not Settings.system.silent_creation:
+        print(f"{label}: {written} nodes were embedded in {elapsed:.2f} s ({stats['nodes_per_second']:.1f} nodes/s)")
+
+    return stats
+
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from law_rag.knowledge.db_connection import check_connection
+    from law_rag.models.embeddings_wrapper import get_embeddings
+
+    load_dotenv()
+    # Here we can fill in all missing embeddings
+    driver = check_connection()
+    embeddings = get_embeddings()
+    for mode in ["naive", "holmes"]:
+        write_embeddings(driver, embeddings, mode)
+    driver.close()
@@ -0,0 +1,21 @@
+"""
+Graph version stamp.
+
+Build scripts set a new version after every change of the graph, and the API compares it
+with the version that cached retrieval results and answers were made with.
+"""
+from neo4j import Driver
+
+from law_rag.knowledge.commands import bump_graph_version_command, get_graph_version_command
+
+
+def bump_graph_version(driver: Driver) -> str:
+    """Set a new graph version and return it"""
+    records, _, _ = driver.execute_query(bump_graph_version_command())
+    return records[0]["version"]
+
+
+def get_graph_version(driver: Driver) -> str | None:
+    """Current graph version. It is None if the graph was never built with version stamps"""
+    records, _, _ = driver.execute_query(get_graph_version_command())
+    return records[0]["version"]
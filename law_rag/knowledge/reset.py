@@ -0,0 +1,120 @@
+"""
+Delete nodes from the Graph Database in many small transactions.
+
+Deleting the whole graph in one transaction keeps every deleted node and relationship in the Neo4j heap.
+Here nodes are deleted chunk by chunk with `CALL { ... } IN TRANSACTIONS`, so the memory usage is bounded
+and the progress can be shown.
+
+You can run this .py file to reset the graph:
+```
+python law_rag/knowledge/reset.py naive --codex 149
+```
+"""
+import time
+
+from neo4j import Driver
+from tqdm import tqdm
+
+from law_rag.knowledge.commands import (
+    count_nodes_to_delete,
+    delete_nodes_in_transactions,
+    delete_index
+)
+from law_rag.config import Settings
+
+from typing import Literal
+
+
+def delete_in_batches(
+    driver: Driver,
+    mode: Literal["all", "naive", "holmes"] = "all",
+    codex: str | None = None,
+    batch_size: int = Settings.build.delete_batch_size
+) -> int:
+    """Delete nodes with their relationships in transactions of `batch_size` nodes
+
+    Arguments
+    ---------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    mode: Literal["all", "naive", "holmes"] = "all"
+        What nodes to delete
+    codex: str | None = None
+        Delete only the subtree of this Codex (for example, "149"). Works only with "naive" mode
+    batch_size: int
+        Number of nodes in one transaction
+
+    Returns
+    -------
+    deleted: int
+        Number of deleted nodes
+
+    Raises
+    ------
+    ValueError
+        If the codex is set not for "naive" mode
+    """
+    if codex is not None and mode != "naive":
+        raise ValueError(f"Only Codex nodes could be deleted by the Codex number, but mode is {mode}")
+
+    parameters = {"codex": codex} if codex is not None else {}
+    # One query deletes this number of nodes, and the progress is updated after it
+    chunk_size = batch_size * 10
+
+    start = time.perf_counter()
+    deleted = 0
+
+    # CALL { ... } IN TRANSACTIONS works only in auto-commit transactions, so session.run is used
+    with driver.session() as session:
+        total = session.run(count_nodes_to_delete(mode, codex), **parameters).single()["total"]
+        command = delete_nodes_in_transactions(mode, codex)
+
+        with tqdm(total = total, disable = Settings.system.silent_creation) as progress:
+            while True:
+                record = session.run(command, limit = chunk_size, batch_size = batch_size, **parameters).single()
+                if record is None or record["deleted"] == 0:
+                    break
+
+                deleted += record["deleted"]
+                progress.update(record["deleted"])
+
+    if not Settings.system.silent_creation:
+        elapsed = time.perf_counter() - start
+        print(f"{deleted} nodes were deleted in {elapsed:.2f} s")
+
+    return deleted
+
+
+def reset_graph(
+    driver: Driver,
+    mode: Literal["all", "naive", "holmes"] = "all",
+    codex: str | None = None
+) -> None:
+    """Delete the vector index (if the whole mode is reset) and the nodes"""
+    if codex is None:
+        match mode:
+            case "all":
+                driver.execute_query(delete_index("naive"))
+                driver.execute_query(delete_index("holmes"))
+
+            case "naive" | "holmes":
+                driver.execute_query(delete_index(mode))
+
+    delete_in_batches(driver, mode, codex)
+
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from law_rag.knowledge.db_connection import check_connection
+
+    parser = argparse.ArgumentParser(description = "Delete nodes from the Knowledge Graph")
+    parser.add_argument("mode", choices = ["all", "naive", "holmes"])
+    parser.add_argument("--codex", default = None, help = "Delete only this Codex subtree (naive mode)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    driver = check_connection()
+    reset_graph(driver, args.mode, args.codex)
+    driver.close()
@@ -0,0 +1,181 @@
+"""
+Schema of the Graph Database: constraints (and their backing indexes) that MERGE-heavy builds need.
+
+Every node is created with `MERGE (n:Label {number: ...})` or `MERGE (s:Entity {name: ...})`.
+Without an index on this key every MERGE is a label scan, so the constraints have to be applied
+before the graph is built.
+
+You can run this .py file to apply the schema and print the report.
+"""
+from neo4j import Driver
+from pydantic import BaseModel
+
+from law_rag.knowledge.commands import (
+    create_unique_constraint_command,
+    show_constraints_command,
+    show_indexes_command
+)
+from law_rag.config import Settings
+
+from typing import List
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SchemaItem(BaseModel):
+    """Uniqueness constraint on the Node key
+
+    Parameters
+    ----------
+    name: str
+        Constraint name
+    label: str
+        Node label
+    property_name: str
+        Node key parameter
+    """
+    name: str
+    label: str
+    property_name: str
+
+    def command(self) -> str:
+        return create_unique_constraint_command(self.name, self.label, self.property_name)
+
+
+class SchemaReport(BaseModel):
+    """What exists in the database versus what is expected
+
+    Parameters
+    ----------
+    existing: List[str]
+        Names of expected constraints that exist and whose indexes are ONLINE
+    missing: List[str]
+        Names of expected constraints that do not exist
+    not_online: List[str]
+        Names of expected constraints whose backing indexes are not ONLINE yet
+    unexpected: List[str]
+        Names of constraints in the database that are not declared here
+    """
+    existing: List[str]
+    missing: List[str]
+    not_online: List[str]
+    unexpected: List[str]
+
+    @property
+    def ok(self) -> bool:
+        return not self.missing and not self.not_online
+
+    def __str__(self) -> str:
+        return (
+            f"Existing: {self.existing}\n"
+            f"Missing: {self.missing}\n"
+            f"Not online: {self.not_online}\n"
+            f"Unexpected: {self.unexpected}"
+        )
+
+
+def expected_schema() -> List[SchemaItem]:
+    """Constraints for the Codex/Article/Paragraph/Subparagraph and HOLMES Entity lookups"""
+    schema = [
+        SchemaItem(name = f"{label.lower()}_number_unique", label = label, property_name = "number")
+        for label in ["Codex", "Article", "Paragraph", "Subparagraph"]
+    ]
+    schema.append(SchemaItem(
+        name = f"{Settings.data.holmes_node.lower()}_name_unique",
+        label = Settings.data.holmes_node,
+        property_name = "name"
+    ))
+    return schema
+
+
+def schema_report(driver: Driver) -> SchemaReport:
+    """Compare the constraints in the database with the expected ones
+
+    Constraints are matched by the label and the property, not by the name,
+    so the same constraint created by hand is recognized too.
+    """
+    constraints, _, _ = driver.execute_query(show_constraints_command())
+    indexes, _, _ = driver.execute_query(show_indexes_command())
+
+    # (label, property) -> constraint name
+    existing_constraints = {
+        (record["labelsOrTypes"][0], record["properties"][0]): record["name"]
+        for record in constraints
+        if "UNIQUENESS" in record["type"] and len(record["properties"]) == 1
+    }
+    index_states = {
+        (record["labelsOrTypes"][0], record["properties"][0]): record["state"]
+        for record in indexes
+        if record["type"] == "RANGE" and record["labelsOrTypes"] and len(record["properties"]) == 1
+    }
+
+    existing, missing, not_online = [], [], []
+    expected_keys = set()
+    for item in expected_schema():
+        key = (item.label, item.property_name)
+        expected_keys.add(key)
+
+        if key not in existing_constraints:
+            missing.append(item.name)
+        elif index_states.get(key) != "ONLINE":
+            not_online.append(item.name)
+        else:
+            existing.append(item.name)
+
+    unexpected = [name for key, name in existing_constraints.items() if key not in expected_keys]
+
+    return SchemaReport(
+        existing = existing,
+        missing = missing,
+        not_online = not_online,
+        unexpected = unexpected
+    )
+
+
+def apply_schema(driver: Driver, timeout: int = 300) -> SchemaReport:
+    """Create all expected constraints that do not exist yet and wait until their indexes are ONLINE
+
+    It is idempotent, so it is safe to call it before every build.
+
+    Arguments
+    ---------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    timeout: int = 300
+        Seconds to wait for the indexes
+
+    Returns
+    -------
+    report: SchemaReport
+        Schema state after applying
+    """
+    for item in expected_schema():
+        driver.execute_query(item.command())
+
+    driver.execute_query("CALL db.awaitIndexes($timeout)", timeout = timeout)
+
+    report = schema_report(driver)
+    if not Settings.system.silent_creation:
+        print("Graph schema was applied")
+    return report
+
+
+def verify_schema(driver: Driver) -> SchemaReport:
+    """Check the schema and log a warning if something is missing. Nothing is created"""
+    report = schema_report(driver)
+    if not report.ok:
+        logger.warning(f"Graph schema is incomplete, builds and lookups will be slow:\n{report}")
+    return report
+
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from law_rag.knowledge.db_connection import check_connection
+
+    load_dotenv()
+    # Here we can apply the schema and check what exists
+    driver = check_connection()
+    print(apply_schema(driver))
+    driver.close()
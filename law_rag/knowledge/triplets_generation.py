@@ -2,6 +2,7 @@ from law_rag.build_graph import document_split
 from law_rag.documents.common import list_files_in_foler, save_pkl
 from law_rag.models.llm_wrapper import get_llm_model
 from law_rag.models.blanks import HOLMES_SYSTEM_GET_TRIPLETS
+from law_rag.profiling import profile_run
 
 from law_rag.config import Settings
 
@@ -15,6 +16,7 @@ from langchain_core.exceptions import OutputParserException
 from typing import List, Dict
 
 from tqdm import tqdm
+import argparse
 import logging
 
 
@@ -100,6 +102,14 @@ def generate_triplets():
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Generate the Holmes triplets from the Codexes with the LLM")
+    parser.add_argument(
+        "--profile",
+        action = "store_true",
+        help = "Write pstats, collapsed stacks and top memory allocations of the generation to the profile folder"
+    )
+    args = parser.parse_args()
+
     # Logging point
     logging.basicConfig(
         filename = Settings.system.logging_file,
@@ -110,4 +120,5 @@ if __name__ == "__main__":
     logger = logging.getLogger(__name__)
 
     # Actual generation
-    generate_triplets()
\ No newline at end of file
+    with profile_run("triplets_generation", enabled = args.profile):
+        generate_triplets()
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""
+Vector indexes management.
+
+Indexes `node_embeddings` (naive) and `holmes_embeddings` (holmes) are created explicitly
+with the dimension and the similarity function from the config and with Neo4j 5 index options:
+- `vector.quantization.enabled` - less memory and faster search for a bit lower recall
+- `vector.hnsw.m` - number of HNSW neighbours per node. Higher is better recall, more memory
+- `vector.hnsw.ef_construction` - HNSW build quality. Higher is better recall, slower build
+
+You can run this .py file to (re)create the indexes and print their reports.
+"""
+import time
+
+from neo4j import Driver
+
+from law_rag.knowledge.commands import (
+    create_index_embeddings,
+    show_vector_index_command,
+    count_nodes_with_embeddings,
+    delete_index
+)
+from law_rag.knowledge.embedding_writer import embeddings_target
+from law_rag.config import Settings
+
+from typing import Dict, Literal, Any
+
+
+def index_name(mode: Literal["naive", "holmes"]) -> str:
+    match mode:
+        case "naive":
+            return Settings.data.index_name
+
+        case "holmes":
+            return Settings.data.holmes_index_name
+
+
+def index_config() -> Dict[str, int | str | bool]:
+    """Vector index settings from the config"""
+    return {
+        "vector.dimensions": Settings.models.embeddings_dimension,
+        "vector.similarity_function": Settings.models.similarity_function,
+        "vector.quantization.enabled": Settings.vector_index.quantization,
+        "vector.hnsw.m": Settings.vector_index.hnsw_m,
+        "vector.hnsw.ef_construction": Settings.vector_index.hnsw_ef_construction
+    }
+
+
+def wait_for_index(
+    driver: Driver,
+    name: str,
+    timeout: int = Settings.vector_index.online_timeout
+) -> Dict[str, Any]:
+    """Wait until the index is ONLINE
+
+    Raises
+    ------
+    TimeoutError
+        If the index is not ONLINE after `timeout` seconds
+    RuntimeError
+        If the index does not exist or it is FAILED
+    """
+    deadline = time.perf_counter() + timeout
+
+    while True:
+        records, _, _ = driver.execute_query(show_vector_index_command(), name = name)
+        if not records:
+            raise RuntimeError(f"There is no vector index {name}")
+
+        record = records[0]
+        match record["state"]:
+            case "ONLINE":
+                return record.data()
+
+            case "FAILED":
+                raise RuntimeError(f"Vector index {name} is FAILED")
+
+        if time.perf_counter() > deadline:
+            raise TimeoutError(f"Vector index {name} is not ONLINE after {timeout} s: {record['populationPercent']}%")
+
+        time.sleep(1)
+
+
+def index_report(driver: Driver, mode: Literal["naive", "holmes"]) -> Dict[str, Any]:
+    """State and size of the vector index
+
+    Size is estimated: vectors (4 bytes per dimension, or 1 byte if quantized)
+    and HNSW graph links (2 * m neighbours of 8 bytes per node).
+    """
+    name = index_name(mode)
+    label, _ = embeddings_target(mode)
+
+    records, _, _ = driver.execute_query(show_vector_index_command(), name = name)
+    if not records:
+        return {"name": name, "state": "NOT EXISTS"}
+
+    record = records[0]
+    nodes, _, _ = driver.execute_query(count_nodes_with_embeddings(label))
+    entries = nodes[0]["total"]
+
+    config = record["options"]["indexConfig"]
+    bytes_per_dimension = 1 if config.get("vector.quantization.enabled") else 4
+    m = config.get("vector.hnsw.m", 16)
+    size_mb = entries * (config["vector.dimensions"] * bytes_per_dimension + 2 * m * 8) / 1024 / 1024
+
+    return {
+        "name": name,
+        "state": record["state"],
+        "entries": entries,
+        "estimated_size_mb": round(size_mb, 2),
+        "config": config
+    }
+
+
+def create_vector_index(
+    driver: Driver,
+    mode: Literal["naive", "holmes"],
+    recreate: bool = False
+) -> Dict[str, Any]:
+    """Create the vector index, wait until it is ONLINE and report it
+
+    Arguments
+    ---------
+    driver: neo4j.Driver
+        Driver to the neo4j database
+    mode: Literal["naive", "holmes"]
+        Which index to create
+    recreate: bool = False
+        Drop the existing index first. Needed to apply new index options
+
+    Returns
+    -------
+    report: Dict[str, Any]
+        See `index_report`
+    """
+    name = index_name(mode)
+    label, _ = embeddings_target(mode)
+
+    if recreate:
+        driver.execute_query(delete_index(mode))
+
+    start = time.perf_counter()
+    driver.execute_query(create_index_embeddings(
+        index_name = name,
+        node_label = label,
+        embeddings_parameter = Settings.data.embeddings_parameter,
+        index_config = index_config()
+    ))
+    wait_for_index(driver, name)
+
+    report = index_report(driver, mode)
+    if not Settings.system.silent_creation:
+        elapsed = time.perf_counter() - start
+        print(
+            f"Vector index {name} is {report['state']} in {elapsed:.2f} s: "
+            f"{report['entries']} entries, ~{report['estimated_size_mb']} MB"
+        )
+
+    return report
+
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from law_rag.knowledge.db_connection import check_connection
+
+    parser = argparse.ArgumentParser(description = "Create vector indexes")
+    parser.add_argument("mode", choices = ["naive", "holmes"], nargs = "+")
+    parser.add_argument("--recreate", action = "store_true", help = "Drop the index first to apply new options")
+    args = parser.parse_args()
+
+    load_dotenv()
+    driver = check_connection()
+    for mode in args.mode:
+        print(create_vector_index(driver, mode, args.recreate))
+    driver.close()
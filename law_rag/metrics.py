@@ -0,0 +1,264 @@
+"""
+Low-overhead metrics in the Prometheus text format.
+
+Histograms and counters are plain in-process objects: an observation is a `perf_counter` difference,
+a bisect over the bucket bounds and a few additions under a lock, so they could stay on in production.
+The stage timings are labelled by the retrieval mode of the current request, which is kept in the `MODE`
+context variable. Blocking work in the executor should be started with `in_context`, so it sees the mode too.
+"""
+import time
+import threading
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import partial
+
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Sequence, Tuple
+
+# Retrieval mode of the current request ("naive", "holmes" or "all")
+MODE: ContextVar[str] = ContextVar("retrieval_mode", default = "none")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+SPEED_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 30.0, 50.0, 75.0, 100.0, 200.0)
+
+
+def in_context(function: Callable, *args, **kwargs) -> Callable:
+    """The function bound to the current context, for `loop.run_in_executor`
+
+    `run_in_executor` does not copy the context variables to the thread, unlike `asyncio.to_thread`
+    """
+    return partial(copy_context().run, function, *args, **kwargs)
+
+
+def escape_label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    """Base of the labelled metrics
+
+    Parameters
+    ----------
+    name: str
+        Metric name
+    documentation: str
+        HELP line of the metric
+    labels: Sequence[str]
+        Label names. A missing "mode" label is taken from `MODE`
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if "mode" in self.labels and "mode" not in labels:
+            labels["mode"] = MODE.get()
+        return tuple(labels[name] for name in self.labels)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Lines of the metric in the text exposition format"""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self.header() + [
+            f"{self.name}{format_labels(self.labels, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    """Histogram with the fixed bucket upper bounds (the +Inf bucket is added)"""
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> None:
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Labels -> (non-cumulative bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        """Observe the seconds spent in the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+
+        lines = self.header()
+        for key, counts, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "law_rag_stage_seconds",
+    "Seconds spent in a stage of the chat turn",
+    labels = ("stage", "mode")
+)
+TIME_TO_FIRST_TOKEN = Histogram(
+    "law_rag_llm_time_to_first_token_seconds",
+    "Seconds from the LLM request to its first output chunk",
+    labels = ("mode",)
+)
+TOKENS_PER_SECOND = Histogram(
+    "law_rag_llm_tokens_per_second",
+    "Estimated output tokens per second after the first token",
+    labels = ("mode",),
+    buckets = SPEED_BUCKETS
+)
+TURNS = Counter(
+    "law_rag_turns_total",
+    "Answered questions by the result: generated, cached, rejected, cancelled or failed",
+    labels = ("mode", "result")
+)
+GENERATED_TOKENS = Counter(
+    "law_rag_llm_generated_tokens_total",
+    "Estimated output tokens of the completed generations",
+    labels = ("mode",)
+)
+ACTIVE_SESSIONS = Gauge("law_rag_active_sessions", "Open chat WebSocket connections")
+
+REGISTRY: List[Metric] = [
+    STAGE_SECONDS,
+    TIME_TO_FIRST_TOKEN,
+    TOKENS_PER_SECOND,
+    TURNS,
+    GENERATED_TOKENS,
+    ACTIVE_SESSIONS
+]
+
+
+def stage(name: str) -> Any:
+    """Time the block as the stage of the current request: `with stage("embedding"): ...`"""
+    return STAGE_SECONDS.time(stage = name)
+
+
+class GenerationTimer:
+    """Time to the first token, generation time and speed of one LLM answer
+
+    The timer starts when it is created, so it should be created right before the LLM request
+    """
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.first_token_at: float | None = None
+
+    def token(self) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            TIME_TO_FIRST_TOKEN.observe(self.first_token_at - self.start)
+
+    async def watch(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Pass the stream through, noting its first chunk"""
+        async for chunk in stream:
+            self.token()
+            yield chunk
+
+    def finish(self, tokens: int) -> None:
+        """Observe the completed generation of `tokens` (estimated) output tokens"""
+        end = time.perf_counter()
+        STAGE_SECONDS.observe(end - self.start, stage = "generation")
+
+        GENERATED_TOKENS.inc(tokens)
+        if self.first_token_at is not None and end > self.first_token_at:
+            TOKENS_PER_SECOND.observe(tokens / (end - self.first_token_at))
+
+
+def render(extra: Sequence[Metric] = ()) -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in list(REGISTRY) + list(extra):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
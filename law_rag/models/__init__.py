@@ -1,3 +1,7 @@
+from . import tokens
+from . import embeddings_cache
 from . import embeddings_wrapper
 from . import llm_wrapper
-from . import blanks
\ No newline at end of file
+from . import blanks
+from . import history_window
+from . import context_packer
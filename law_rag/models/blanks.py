@@ -1,7 +1,7 @@
 from langchain.schema import SystemMessage, AIMessage, HumanMessage
 from langchain_core.prompts.prompt import PromptTemplate
 
-from law_rag.knowledge.graph_building import chunk_number_to_str
+from law_rag.models.context_packer import pack_documents, pack_triplets
 
 from langchain_core.documents import Document
 from typing import List
@@ -35,6 +35,8 @@ START_MESSAGE = AIMessage(content = """Приветствую! Я могу по
 
 ERROR_MESSAGE: str = "Упс! Кажется, что-то пошло не так... Попробуйте перезагрузить страницу."
 
+OVERLOADED_MESSAGE: str = "Сейчас слишком много вопросов, я не успеваю на все ответить. Попробуйте задать вопрос чуть позже."
+
 
 def add_retirver_answer_to_question(
     question: str,
@@ -50,22 +52,27 @@ def add_retirver_answer_to_question(
     return answer
 
 
+def remove_retirver_answer_from_question(message: str) -> str:
+    """The user question without the retriever context added by `add_retirver_answer_to_question`
+
+    Messages without the context are returned as they are.
+    """
+    prefix = "Вопрос пользователя: "
+    if not message.startswith(prefix) or "\n\n#####\n" not in message:
+        return message
+    return message[len(prefix) : message.index("\n\n#####\n")]
+
+
 def transform_answer_list(
     retriever_answer: List[Document], 
     ship_headers: bool = False
 ) -> str:
-    answer = ""
-    for node in retriever_answer:
-        text = node.page_content
-
-        if ship_headers:
-            answer += f"{text}  \n"
-        
-        else:
-            source = chunk_number_to_str(node.metadata["source"])
-            answer += f"### Отрывок из {source}\n"
-            answer += f"{text}\n"
-            answer += "\n"
+    """Retrieved context: deduplicated and packed to the token budget (see `law_rag.models.context_packer`)"""
+    if ship_headers:
+        answer = pack_triplets(retriever_answer)
+    
+    else:
+        answer = pack_documents(retriever_answer)
     
     answer = answer[:-1] # Remove the last \n
     return answer
@@ -0,0 +1,149 @@
+"""
+Context assembly for the prompt: retrieved chunks are deduplicated, packed to a token budget and ordered.
+
+Every naive hit brings the document with its previous, next and inner paragraphs (see `retrieval_query`),
+so neighbouring hits share a lot of chunks. Here every chunk number is taken once. The hit documents
+themselves are always taken, so the top hits are never lost, and the rest of the budget is filled by priority:
+their inner parts (by the hit score), then the neighbours. The chosen chunks are ordered and grouped
+by the codex/article hierarchy.
+
+Token counts are precomputed for every node at the graph building (`tokens` parameter)
+and estimated here only for the graphs built before.
+"""
+from langchain_core.documents import Document
+
+from law_rag.knowledge.graph_building import chunk_number_to_str
+from law_rag.models.tokens import estimate_tokens
+from law_rag.config import Settings
+
+from typing import Any, Dict, List, Tuple
+
+
+def chunk_sort_key(number: str) -> Tuple[Tuple[int, int, str], ...]:
+    """Natural order of the chunk numbers: "149.2.10" goes after "149.2.9" """
+    return tuple(
+        (0, int(part), "") if part.isdigit() else (1, 0, part)
+        for part in number.split(".")
+    )
+
+
+def article_key(chunk: Dict[str, Any]) -> str:
+    """Number of the Article node the chunk belongs to, like "149.10.1"
+
+    It is taken from the graph (`article` of the chunk), because the chunk number is ambiguous:
+    "149.10.1.3" is paragraph 3 of article 10.1 as well as subparagraph 3 of paragraph 1 of article 10.
+    Only the chunks without it (the graphs built before) fall back to the first two parts of the number.
+    """
+    article = chunk.get("article")
+    if article:
+        return article
+    return ".".join(chunk["number"].split(".")[:2])
+
+
+def article_source(article: str) -> str:
+    """Header of the article group, like "149-ФЗ, Статья 10.1" """
+    codex, _, number = article.partition(".")
+    return f"{codex}-ФЗ, Статья {number}" if number else chunk_number_to_str(article + ".0")
+
+
+def _chunk_tokens(chunk: Dict[str, Any]) -> int:
+    tokens = chunk.get("tokens")
+    return tokens if tokens is not None else estimate_tokens(chunk["text"])
+
+
+def _priority_tiers(documents: List[Document]) -> List[List[Dict[str, Any]]]:
+    """Chunks of the hits by priority: documents, inner parts, neighbours"""
+    hits, inner, neighbours = [], [], []
+
+    for document in documents:
+        metadata = document.metadata
+        if "document" not in metadata:
+            # The whole joined text of the hit, if the query does not return the parts
+            hits.append({"number": metadata["source"], "text": document.page_content, "tokens": None, "article": None})
+            continue
+
+        hits.append(metadata["document"])
+        inner.extend(metadata.get("inner") or [])
+        neighbours.extend(chunk for chunk in [metadata.get("prev"), metadata.get("next")] if chunk)
+
+    return [hits, inner, neighbours]
+
+
+def pack_documents(
+    documents: List[Document],
+    budget_tokens: int = Settings.context.budget_tokens
+) -> str:
+    """Context from the Codex hierarchy hits
+
+    Arguments
+    ---------
+    documents: List[Document]
+        Retriever hits, the best first
+    budget_tokens: int
+        Maximum estimated tokens of the context. The hit documents are taken even if they are over the budget
+
+    Returns
+    -------
+    context: str
+        Chunks under "### Отрывок из ..." headers, grouped by article
+    """
+    selected: Dict[str, Dict[str, Any]] = {}
+    used = 0
+
+    for priority, tier in enumerate(_priority_tiers(documents)):
+        for chunk in tier:
+            if chunk["number"] in selected or not chunk.get("text"):
+                continue
+
+            tokens = _chunk_tokens(chunk)
+            if used + tokens > budget_tokens and priority > 0:
+                continue
+
+            selected[chunk["number"]] = chunk
+            used += tokens
+
+    # Chunks are grouped by their article, so article 10 and article 10.1 are never mixed under one header
+    ordered = sorted(
+        selected.values(),
+        key = lambda chunk: (chunk_sort_key(article_key(chunk)), chunk_sort_key(chunk["number"]))
+    )
+
+    answer = ""
+    header = None
+    for chunk in ordered:
+        article = article_key(chunk)
+        if article != header:
+            if header is not None:
+                answer += "\n"
+            answer += f"### Отрывок из {article_source(article)}\n"
+            header = article
+        answer += f"{chunk['text']}\n"
+
+    if answer:
+        answer += "\n"
+    return answer
+
+
+def pack_triplets(
+    documents: List[Document],
+    budget_tokens: int = Settings.context.holmes_budget_tokens
+) -> str:
+    """Context from the HOLMES hits: unique triplets in the order of the hits, up to the budget"""
+    seen = set()
+    used = 0
+    answer = ""
+
+    for document in documents:
+        text = document.page_content
+        if not text or text in seen:
+            continue
+
+        tokens = estimate_tokens(text)
+        if used + tokens > budget_tokens and seen:
+            break
+
+        seen.add(text)
+        used += tokens
+        answer += f"{text}  \n"
+
+    return answer
@@ -0,0 +1,274 @@
+"""
+Persistent content-addressed cache for the embeddings vectors.
+
+Vectors are stored in one memory-mapped float32 file (a slot per text), the key of every slot
+in another one, and the index file keeps the least recently used order. The cache is shared
+by the graph build, the API and the evaluation scripts, so the same text is never embedded twice by the same model.
+"""
+import os
+import re
+import json
+import fcntl
+import atexit
+import hashlib
+import threading
+from pathlib import Path
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+from langchain_core.embeddings import Embeddings
+
+from typing import Dict, Iterator, List
+
+import logging
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+KEYS_FILE = "keys.bin"
+INDEX_FILE = "index.json"
+LOCK_FILE = "lock"
+KEY_BYTES = 32
+
+
+def text_hash(model_name: str, text: str) -> str:
+    """The cache key: hash of the model name and the text"""
+    return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingsCache:
+    """On-disk cache of the embeddings vectors for the one model
+
+    Several processes could use the same cache at once. Every slot stores the key of it's text
+    next to the vector (`keys.bin`), and it is checked on every read, so a slot overwritten by another process
+    is a miss, not a wrong vector. Writes of the slots and of the index file are done under a file lock,
+    and the index file is merged with the one on disk before it is replaced.
+
+    Parameters
+    ----------
+    path: str
+        Folder for all caches. Every model has it's own subfolder
+    model_name: str
+        Embeddings model name
+    dimension: int
+        Embeddings vector dimension
+    max_size_mb: int
+        Maximum size of the vectors file. When it is full, the least recently used vectors are evicted
+    flush_every: int = 100
+        Write the index file after this number of new vectors
+    """
+    def __init__(
+        self,
+        path: str,
+        model_name: str,
+        dimension: int,
+        max_size_mb: int,
+        flush_every: int = 100
+    ) -> None:
+        self.model_name = model_name
+        self.dimension = dimension
+        self.capacity = max(1, max_size_mb * 1024 * 1024 // (dimension * 4))
+        self.flush_every = flush_every
+
+        self.folder = Path(path) / re.sub(r"[^\w.-]", "_", model_name)
+        self.folder.mkdir(parents = True, exist_ok = True)
+
+        self._lock = threading.Lock()
+        # flock is held by the open file, so the threads of one process are separated by `_lock`
+        self._lock_file = open(self.folder / LOCK_FILE, mode = "a+b")
+        self._dirty = 0
+        # text hash -> slot, in the least recently used order
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._free_slots: List[int] = []
+
+        with self._locked():
+            self._load()
+        atexit.register(self.flush)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Lock against the other threads and the other processes"""
+        with self._lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _load(self) -> None:
+        vectors_path = self.folder / VECTORS_FILE
+        keys_path = self.folder / KEYS_FILE
+
+        valid = (
+            vectors_path.exists() and keys_path.exists()
+            and vectors_path.stat().st_size == self.capacity * self.dimension * 4
+            and keys_path.stat().st_size == self.capacity * KEY_BYTES
+        )
+        if not valid and vectors_path.exists():
+            logger.warning(f"Embeddings cache in {self.folder} has another shape and will be rebuilt")
+
+        mode = "r+" if valid else "w+"
+        self.vectors = np.memmap(vectors_path, dtype = np.float32, mode = mode, shape = (self.capacity, self.dimension))
+        # All zeros is the empty slot
+        self.keys = np.memmap(keys_path, dtype = np.uint8, mode = mode, shape = (self.capacity, KEY_BYTES))
+        if not valid:
+            (self.folder / INDEX_FILE).unlink(missing_ok = True)
+
+        self._merge_index()
+
+    def _slot_key(self, slot: int) -> str | None:
+        key = self.keys[slot]
+        return key.tobytes().hex() if key.any() else None
+
+    def _merge_index(self) -> None:
+        """Take the entries from the slot keys and their order from the index file and this process
+
+        Should be called under the lock
+        """
+        index_path = self.folder / INDEX_FILE
+        disk_entries = []
+        if index_path.exists():
+            with open(index_path, mode = "r", encoding = "utf-8") as file:
+                disk_entries = json.load(file)["entries"]
+
+        occupied = {
+            self.keys[slot].tobytes().hex(): int(slot)
+            for slot in np.flatnonzero(self.keys.any(axis = 1))
+        }
+
+        # Slots that are not in any index are the oldest, then the index on disk, then the recent ones of this process
+        merged: OrderedDict[str, int] = OrderedDict()
+        for key, slot in list(occupied.items()) + disk_entries + list(self._entries.items()):
+            if occupied.get(key) == slot:
+                merged[key] = slot
+                merged.move_to_end(key)
+
+        self._entries = merged
+        used = set(merged.values())
+        self._free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    def flush(self) -> None:
+        """Write the vectors and the index file on disk"""
+        with self._locked():
+            self.vectors.flush()
+            self.keys.flush()
+            self._merge_index()
+
+            index = {
+                "model": self.model_name,
+                "dimension": self.dimension,
+                "capacity": self.capacity,
+                "entries": list(self._entries.items())
+            }
+            # Atomic replace, so a crash could not leave a broken index
+            tmp_path = self.folder / (INDEX_FILE + ".tmp")
+            with open(tmp_path, mode = "w+t", encoding = "utf-8") as file:
+                json.dump(index, file)
+            os.replace(tmp_path, self.folder / INDEX_FILE)
+
+            self._dirty = 0
+
+    def get(self, text: str) -> np.ndarray | None:
+        """Get the copy of the cached vector"""
+        key = text_hash(self.model_name, text)
+        with self._locked():
+            slot = self._entries.get(key)
+            if slot is None:
+                return None
+
+            if self._slot_key(slot) != key:
+                # The slot was given to another text by another process
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return np.array(self.vectors[slot])
+
+    def _allocate(self) -> int:
+        """Free slot or the least recently used one. Should be called under the lock"""
+        while self._free_slots:
+            slot = self._free_slots.pop()
+            other_key = self._slot_key(slot)
+            if other_key is None:
+                return slot
+
+            # Taken by another process after the last merge
+            self._entries[other_key] = slot
+            self._entries.move_to_end(other_key, last = False)
+
+        _, slot = self._entries.popitem(last = False)
+        return slot
+
+    def put(self, text: str, vector: List[float]) -> None:
+        """Store the vector. The least recently used one is evicted if the cache is full"""
+        key = text_hash(self.model_name, text)
+        with self._locked():
+            slot = self._entries.pop(key, None)
+            if slot is None or self._slot_key(slot) != key:
+                slot = self._allocate()
+
+            # The key is cleared first, so a crash in the middle leaves an empty slot, not a wrong vector
+            self.keys[slot] = 0
+            self.vectors[slot] = vector
+            self.keys[slot] = np.frombuffer(bytes.fromhex(key), dtype = np.uint8)
+
+            self._entries[key] = slot
+            self._dirty += 1
+            need_flush = self._dirty >= self.flush_every
+
+        if need_flush:
+            self.flush()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that looks into the `EmbeddingsCache` first
+    and sends to the model only texts that are not cached yet
+
+    Parameters
+    ----------
+    embeddings: Embeddings
+        The actual embeddings model
+    cache: EmbeddingsCache
+        Cache of the vectors for this model
+    """
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingsCache) -> None:
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached.tolist()
+
+        vector = self.embeddings.embed_query(text)
+        self.cache.put(text, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        answers: List[List[float] | None] = [None] * len(texts)
+        # Text -> indexes of it in the input (texts could be repeated)
+        missed: Dict[str, List[int]] = {}
+
+        for index, text in enumerate(texts):
+            cached = self.cache.get(text)
+            if cached is not None:
+                answers[index] = cached.tolist()
+            else:
+                missed.setdefault(text, []).append(index)
+
+        if missed:
+            missed_texts = list(missed)
+            vectors = self.embeddings.embed_documents(missed_texts)
+
+            for text, vector in zip(missed_texts, vectors):
+                self.cache.put(text, vector)
+                for index in missed[text]:
+                    answers[index] = vector
+
+            self.cache.flush()
+
+        return answers
@@ -2,31 +2,167 @@
 # https://github.com/langchain-ai/langchain/issues/15729
 # to use Huggingface Embeddings Model with Neo4j Vector Store
 
+import threading
+
+import torch
+
 from langchain_core.embeddings import Embeddings
 from transformers import AutoTokenizer, AutoModel
 
+from law_rag.models.embeddings_cache import EmbeddingsCache, CachedEmbeddings
+from law_rag.metrics import stage
 from law_rag.config import Settings
 
 from typing import List
 
 
+def length_buckets(lengths: List[int], batch_size: int) -> List[List[int]]:
+    """Split text indexes into batches of texts with close token lengths
+
+    Texts are sorted by their token length, so every padded batch wastes as few
+    pad tokens as possible. Indexes are returned (not texts) to restore the original order after all.
+
+    Arguments
+    ---------
+    lengths: List[int]
+        Token length of every text
+    batch_size: int
+        Maximum number of texts in one batch
+
+    Returns
+    -------
+    buckets: List[List[int]]
+        Batches of text indexes
+    """
+    order = sorted(range(len(lengths)), key = lambda index: lengths[index])
+    buckets = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    return buckets
+
+
 class HuggingFaceEmbeddings(Embeddings):
-    def __init__(self, model_name: str) -> None:
+    def __init__(self, model_name: str, batch_size: int = Settings.models.embeddings_batch_size) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
         self.model = AutoModel.from_pretrained(model_name)
+        self.model.eval()
+
+        # Fast tokenizers could not be used from many threads at once ("Already borrowed" error),
+        # but the model forward pass could
+        self._tokenizer_lock = threading.Lock()
+
+    def tokenize(self, texts: str | List[str], **kwargs):
+        with self._tokenizer_lock:
+            return self.tokenizer(texts, truncation = True, **kwargs)
 
     def embed_query(self, text: str) -> List[float]:
-        inputs = self.tokenizer(text, return_tensors = 'pt', truncation = True)
-        outputs = self.model(**inputs)
-        return outputs.last_hidden_state.sum(dim = 1)[0].detach().numpy().tolist()
-    
+        with stage("embedding"):
+            inputs = self.tokenize(text, return_tensors = 'pt')
+            with torch.inference_mode():
+                outputs = self.model(**inputs)
+            return outputs.last_hidden_state.sum(dim = 1)[0].numpy().tolist()
+
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
-        answers = []
-        for text in texts:
-            answers.append(self.embed_query(text))
+        """Embed texts in padded batches
+
+        Texts are grouped into length buckets and every bucket is run through the model at once.
+        Pad tokens are masked out of the sum pooling, so the vectors are the same
+        (within a float tolerance) as `embed_query` makes for each text separately.
+        """
+        if len(texts) == 0:
+            return []
+
+        lengths = [len(ids) for ids in self.tokenize(texts)["input_ids"]]
+        answers: List[List[float] | None] = [None] * len(texts)
+
+        for bucket in length_buckets(lengths, self.batch_size):
+            inputs = self.tokenize(
+                [texts[index] for index in bucket],
+                return_tensors = 'pt',
+                padding = True
+            )
+            with torch.inference_mode():
+                outputs = self.model(**inputs)
+
+            # Sum pooling only over the real tokens
+            mask = inputs["attention_mask"].unsqueeze(-1).to(outputs.last_hidden_state.dtype)
+            vectors = (outputs.last_hidden_state * mask).sum(dim = 1).numpy().tolist()
+
+            for index, vector in zip(bucket, vectors):
+                answers[index] = vector
+
         return answers
 
 
-def get_embeddings():
-    embeddings = HuggingFaceEmbeddings(Settings.models.embeddings_model)
-    return embeddings
\ No newline at end of file
+def get_embeddings() -> Embeddings:
+    """Get the embeddings model from the config
+
+    If the embeddings cache is enabled, the model is wrapped with it,
+    so already embedded texts are taken from the disk.
+    """
+    cache_name = Settings.models.embeddings_model
+
+    match Settings.models.embeddings_engine:
+        case "torch":
+            embeddings = HuggingFaceEmbeddings(Settings.models.embeddings_model)
+
+        case "onnx":
+            # ONNX Runtime is an optional dependency
+            from law_rag.models.onnx_embeddings import OnnxEmbeddings
+            embeddings = OnnxEmbeddings(Settings.models.embeddings_model)
+            # Quantized vectors are not the same as PyTorch ones
+            if Settings.models.onnx.quantize:
+                cache_name += "-onnx-int8"
+
+    cache_cfg = Settings.models.embeddings_cache
+    if cache_cfg.enabled:
+        cache = EmbeddingsCache(
+            path = cache_cfg.path,
+            model_name = cache_name,
+            dimension = Settings.models.embeddings_dimension,
+            max_size_mb = cache_cfg.max_size_mb
+        )
+        embeddings = CachedEmbeddings(embeddings, cache)
+
+    return embeddings
+
+
+def check_batched_parity(texts: List[str], tolerance: float = 1e-3) -> float:
+    """Compare batched `embed_documents` vectors with per-text `embed_query` ones
+
+    Arguments
+    ---------
+    texts: List[str]
+        Texts to embed with both paths
+    tolerance: float = 1e-3
+        Maximum allowed relative difference between the vectors
+
+    Returns
+    -------
+    max_difference: float
+        The worst relative difference between the vectors of the same text
+
+    Raises
+    ------
+    AssertionError
+        If some vectors differ more than the tolerance
+    """
+    model = HuggingFaceEmbeddings(Settings.models.embeddings_model)
+    batched = torch.tensor(model.embed_documents(texts))
+    single = torch.tensor([model.embed_query(text) for text in texts])
+
+    max_difference = ((batched - single).norm(dim = 1) / single.norm(dim = 1)).max().item()
+    assert max_difference <= tolerance, f"Batched embeddings differ from single ones: {max_difference}"
+    return max_difference
+
+
+
+if __name__ == "__main__":
+    # We can run this .py file to check if the batched path returns the same vectors
+    difference = check_batched_parity([
+        "Что такое информация?",
+        "Персональные данные - любая информация, относящаяся к прямо или косвенно определенному или определяемому физическому лицу.",
+        "Статья 3. Принципы правового регулирования отношений в сфере информации, информационных технологий и защиты информации"
+    ])
+    print(f"Max relative difference: {difference}")
@@ -0,0 +1,146 @@
+"""
+History policy for the chat chain: keep the prompt under a token budget.
+
+Every stored user message contains the full retriever context, so without a policy
+the prompt (and Ollama prefill time) grows with every turn. `HistoryWindow`:
+1. Removes the retriever context from the past user messages. The current message keeps it
+2. Keeps the last `keep_exchanges` exchanges (question and answer) verbatim
+3. Replaces the older exchanges with a short summary (their questions and the starts of the answers), if enabled
+4. Moves the oldest kept exchanges to the summary while the prompt is over the budget
+
+Tokens are estimated by the number of characters (see `law_rag.models.tokens`).
+"""
+import threading
+
+from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, SystemMessage
+
+from law_rag.models.blanks import SYSTEM_PROMPT, remove_retirver_answer_from_question
+from law_rag.models.tokens import estimate_tokens
+from law_rag.config import Settings
+
+from typing import Dict, List
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def split_exchanges(history: List[BaseMessage]) -> List[List[BaseMessage]]:
+    """Split the history into exchanges, every one starts with a user message"""
+    exchanges: List[List[BaseMessage]] = []
+    for message in history:
+        if isinstance(message, HumanMessage) or not exchanges:
+            exchanges.append([])
+        exchanges[-1].append(message)
+    return exchanges
+
+
+class HistoryWindow:
+    """Token-budgeted history for the chain prompt
+
+    Parameters
+    ----------
+    budget_tokens: int
+        Maximum estimated tokens of the whole prompt: system prompt, history and the current message
+    keep_exchanges: int
+        Number of the last exchanges that are kept verbatim (without the retriever context)
+    summarize: bool
+        Whether to replace the older exchanges with a summary instead of dropping them
+    summary_max_tokens: int
+        Maximum estimated tokens of the summary
+    """
+    def __init__(
+        self,
+        budget_tokens: int = Settings.history.budget_tokens,
+        keep_exchanges: int = Settings.history.keep_exchanges,
+        summarize: bool = Settings.history.summarize,
+        summary_max_tokens: int = Settings.history.summary_max_tokens
+    ) -> None:
+        self.budget_tokens = budget_tokens
+        self.keep_exchanges = keep_exchanges
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+
+        self.system_tokens = estimate_tokens(SYSTEM_PROMPT.content)
+
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.total_prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = 0
+
+    @staticmethod
+    def _strip(exchange: List[BaseMessage]) -> List[BaseMessage]:
+        return [
+            HumanMessage(content = remove_retirver_answer_from_question(message.content))
+            if isinstance(message, HumanMessage) else message
+            for message in exchange
+        ]
+
+    def _summary(self, exchanges: List[List[BaseMessage]], max_tokens: int) -> SystemMessage | None:
+        """Short summary of the old exchanges: the questions and the first sentences of the answers"""
+        lines = []
+        for exchange in exchanges:
+            for message in exchange:
+                if isinstance(message, HumanMessage):
+                    lines.append(f"- Вопрос: {message.content}")
+                elif isinstance(message, AIMessage):
+                    lines.append(f"  Ответ: {message.content.split('. ')[0][:300]}")
+
+        header = "Краткое содержание начала разговора:\n"
+        # The most recent lines are the most useful, so the oldest are dropped first
+        while lines and estimate_tokens(header + "\n".join(lines)) > max_tokens:
+            lines.pop(0)
+
+        if not lines:
+            return None
+        return SystemMessage(content = header + "\n".join(lines))
+
+    def apply(self, history: List[BaseMessage], message: str) -> List[BaseMessage]:
+        """History to put into the prompt for the current `message`"""
+        exchanges = [self._strip(exchange) for exchange in split_exchanges(history)]
+
+        split = max(len(exchanges) - self.keep_exchanges, 0)
+        old, kept = exchanges[:split], exchanges[split:]
+
+        def tokens(exchange: List[BaseMessage]) -> int:
+            return sum(estimate_tokens(item.content) for item in exchange)
+
+        # The last exchanges are more important than the summary, so they take the budget first
+        budget = self.budget_tokens - self.system_tokens - estimate_tokens(message)
+        while kept and sum(tokens(exchange) for exchange in kept) > budget:
+            old.append(kept.pop(0))
+        budget -= sum(tokens(exchange) for exchange in kept)
+
+        summary = None
+        if self.summarize and old:
+            summary = self._summary(old, min(self.summary_max_tokens, budget))
+
+        window = ([summary] if summary is not None else []) + [item for exchange in kept for item in exchange]
+
+        prompt_tokens = (
+            self.system_tokens
+            + estimate_tokens(message)
+            + sum(estimate_tokens(item.content) for item in window)
+        )
+        self._report(prompt_tokens)
+        logger.debug(
+            f"History window: {len(window)} of {len(history)} messages, ~{prompt_tokens} prompt tokens"
+        )
+        return window
+
+    def _report(self, prompt_tokens: int) -> None:
+        with self._lock:
+            self.prompts += 1
+            self.total_prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+            self.last_prompt_tokens = prompt_tokens
+
+    def stats(self) -> Dict[str, float]:
+        """Estimated prompt tokens produced by the window"""
+        return {
+            "prompts": self.prompts,
+            "mean_prompt_tokens": self.total_prompt_tokens / self.prompts if self.prompts else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "budget_tokens": self.budget_tokens
+        }
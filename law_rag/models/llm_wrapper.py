@@ -1,22 +1,35 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from concurrent.futures import Executor
+
 from langchain_ollama import ChatOllama
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables.history import RunnableWithMessageHistory
+from langchain_core.runnables import RunnablePassthrough
 from langchain_neo4j import Neo4jVector, GraphCypherQAChain, Neo4jGraph
 
 from langchain_core.output_parsers.json import JsonOutputParser
 from langchain_core.output_parsers import StrOutputParser
 
-from law_rag.db_manager.data_management import get_session_history_with_local_file
+from law_rag.db_manager.data_management import get_session_history
+from law_rag.models.history_window import HistoryWindow
 from law_rag.models.blanks import (
     SYSTEM_PROMPT, 
     add_retirver_answer_to_question, 
     transform_answer_list,
     CYPHER_GENERATION_PROMPT
 )
+from law_rag.models.tokens import estimate_tokens
+from law_rag.metrics import stage, in_context
 from law_rag.config import Settings
 
+from langchain_core.embeddings import Embeddings
 from langchain_core.runnables.base import RunnableSerializable
-from typing import Literal, Tuple
+from typing import Literal, Tuple, List, Dict, Deque, AsyncIterator
+
+import logging
+logger = logging.getLogger(__name__)
 
 def get_llm_model(
     model_type: Literal["qwen3:8b", "deepseek-r1:8b", "gemma3:4b", "gemma3:27b"],
@@ -58,20 +71,124 @@ def retriever_answer(
     question: str, 
     retriever: Neo4jVector,
     return_also_raw_answer: bool = False,
-    ship_headers: bool = False
+    ship_headers: bool = False,
+    embedding: List[float] | None = None,
+    k: int = 3
+) -> str | Tuple[str, str]:
+    """Get an answer from Retriever
+    
+    If the question `embedding` is already computed, it is used instead of embedding the question again.
+
+    The "vector_search" stage timing includes the `retrieval_query()` graph expansion,
+    because Neo4j runs them as one query.
+    """
+    if embedding is None:
+        # The same as `similarity_search`, but the embedding and the search are timed apart
+        embedding = retriever.embedding.embed_query(question)
+
+    # `query` is still needed for the full-text part of the hybrid search
+    with stage("vector_search"):
+        answer_nodes = retriever.similarity_search_by_vector(
+            embedding = embedding,
+            k = k,
+            query = question
+        )
+
+    with stage("prompt_assembly"):
+        answer = add_retirver_answer_to_question(question, answer_nodes, ship_headers)
+
+        if return_also_raw_answer:
+            raw_answer = transform_answer_list(answer_nodes, ship_headers)
+            return answer, raw_answer
+
+        return answer
+
+
+async def aretriever_answer(
+    question: str, 
+    retriever: Neo4jVector,
+    executor: Executor | None = None,
+    return_also_raw_answer: bool = False,
+    ship_headers: bool = False,
+    embedding: List[float] | None = None,
+    k: int = 3
 ) -> str | Tuple[str, str]:
-    """Get an answer from Retriever"""
-    answer_nodes = retriever.similarity_search(
-        query = question,
-        k = 3
+    """Get an answer from Retriever without blocking the event loop
+    
+    The retrieval (query embedding and Neo4j requests) is blocking, so it runs in the executor.
+    If the executor is None, the default asyncio one is used.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor,
+        in_context(
+            retriever_answer,
+            question = question,
+            retriever = retriever,
+            return_also_raw_answer = return_also_raw_answer,
+            ship_headers = ship_headers,
+            embedding = embedding,
+            k = k
+        )
     )
-    answer = add_retirver_answer_to_question(question, answer_nodes, ship_headers)
 
-    if return_also_raw_answer:
-        raw_answer = transform_answer_list(answer_nodes, ship_headers)
-        return answer, raw_answer
 
-    return answer
+def merge_retriever_answers(
+    naive_answer: Tuple[str, str],
+    holmes_answer: Tuple[str, str]
+) -> Tuple[str, str]:
+    """Merge naive and holmes answers (with their raw answers) for the "all" mode"""
+    retriever_message_naive, raw_retriever_message_naive = naive_answer
+    retriever_message_holmes, raw_retriever_message_holmes = holmes_answer
+
+    retriever_message = retriever_message_naive + "\n\n" + retriever_message_holmes
+    raw_retriever_message = raw_retriever_message_naive + "\n\n### Триплеты\n" + raw_retriever_message_holmes
+    return retriever_message, raw_retriever_message
+
+
+async def aretriever_answer_all(
+    question: str,
+    embeddings: Embeddings,
+    retriever_naive: Neo4jVector,
+    retriever_holmes: Neo4jVector,
+    executor: Executor | None = None,
+    embedding: List[float] | None = None,
+    k: int = 3
+) -> Tuple[str, str]:
+    """Get an answer from both Retrievers for the "all" mode
+
+    The question is embedded once (or the given `embedding` is used), and then both vector searches
+    (with their graph expansions) run in parallel in the executor. So it takes about as long as the slower one.
+
+    Returns
+    -------
+    (retriever_message, raw_retriever_message): Tuple[str, str]
+        Merged answer for the LLM and raw answer to show to the user
+    """
+    if embedding is None:
+        loop = asyncio.get_running_loop()
+        embedding = await loop.run_in_executor(executor, in_context(embeddings.embed_query, question))
+
+    naive_answer, holmes_answer = await asyncio.gather(
+        aretriever_answer(
+            question = question,
+            retriever = retriever_naive,
+            executor = executor,
+            return_also_raw_answer = True,
+            embedding = embedding,
+            k = k
+        ),
+        aretriever_answer(
+            question = question,
+            retriever = retriever_holmes,
+            executor = executor,
+            return_also_raw_answer = True,
+            ship_headers = True,
+            embedding = embedding,
+            k = k
+        )
+    )
+    return merge_retriever_answers(naive_answer, holmes_answer)
 
 
 def holmes_retriever_chain(graph: Neo4jGraph, model: ChatOllama):
@@ -87,7 +204,7 @@ def holmes_retriever_chain(graph: Neo4jGraph, model: ChatOllama):
     return chain
 
 
-def get_runnable_chain(model):
+def get_runnable_chain(model, history_window: HistoryWindow | None = None):
     """Call format:\n
     - With Streaming:\n
     ```python
@@ -104,6 +221,9 @@ def get_runnable_chain(model):
     ```
     
     config could be created from `make_config_for_chain` function
+
+    If `history_window` is given, the history in the prompt is cut by it to the token budget.
+    The full history is still stored.
     """
     prompt = ChatPromptTemplate.from_messages([
         ("system", SYSTEM_PROMPT.content),
@@ -114,9 +234,14 @@ def get_runnable_chain(model):
     str_parser = StrOutputParser()
     chain = prompt | model | str_parser.with_config({"run_name": Settings.web.run_name})
 
+    if history_window is not None:
+        chain = RunnablePassthrough.assign(
+            history = lambda inputs: history_window.apply(inputs["history"], inputs["input"])
+        ) | chain
+
     runnable_with_history = RunnableWithMessageHistory(
         runnable = chain,
-        get_session_history = get_session_history_with_local_file,
+        get_session_history = get_session_history,
         input_messages_key = "input",
         history_messages_key = "history"
     )
@@ -124,6 +249,230 @@ def get_runnable_chain(model):
     return runnable_with_history
 
 
+def get_qa_chain(model) -> RunnableSerializable:
+    """Chain without the history for the single questions (batch answering)
+
+    Call format:
+    ``` python
+        answer = await qa_chain.ainvoke({'input': user_message})
+    ```
+    """
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT.content),
+        ("user", "{input}")
+    ])
+    return prompt | model | StrOutputParser()
+
+
 def make_config_for_chain(session_id: str) -> dict:
     """Config for runnable_chain"""
     return {"configurable": {"session_id": session_id}}
+
+
+class LLMQueueFull(Exception):
+    """The LLM queue is full, the request should be retried later"""
+
+
+class _Ticket:
+    """Place of one generation request in the `LLMScheduler` queue"""
+    def __init__(self, session_id: str) -> None:
+        self.session_id = session_id
+        self.enqueued = time.perf_counter()
+        self.admitted = False
+        self.changed = asyncio.Event()
+
+
+class LLMScheduler:
+    """Admission control in front of the LLM: limited in-flight generations and a fair queue
+
+    Waiting requests are grouped by the session and served round-robin between the sessions,
+    so one session with many requests does not delay the others. If the queue is full, new requests
+    are rejected with `LLMQueueFull` instead of slowing down everyone.
+
+    Usage (in one event loop):
+    ```python
+        async for position in scheduler.acquire(session_id):
+            ...  # tell the client its position in the queue
+        try:
+            ...  # generation
+        finally:
+            scheduler.release()
+    ```
+
+    Parameters
+    ----------
+    max_in_flight: int
+        Maximum number of simultaneous generations
+    max_queue: int
+        Maximum number of waiting requests
+    """
+    def __init__(
+        self,
+        max_in_flight: int = Settings.api.llm_max_in_flight,
+        max_queue: int = Settings.api.llm_max_queue
+    ) -> None:
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+
+        # Session id -> waiting tickets. The first session is served next
+        self._queues: OrderedDict[str, Deque[_Ticket]] = OrderedDict()
+        self.in_flight = 0
+
+        self.admitted = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def _position(self, ticket: _Ticket) -> int:
+        """Number of requests that will be admitted before the ticket"""
+        index = self._queues[ticket.session_id].index(ticket)
+
+        # Every round takes one request from every session, in the order of the sessions
+        position = sum(min(len(queue), index) for queue in self._queues.values())
+        for session_id, queue in self._queues.items():
+            if session_id == ticket.session_id:
+                break
+            position += int(len(queue) > index)
+        return position
+
+    def _notify(self) -> None:
+        for queue in self._queues.values():
+            for ticket in queue:
+                ticket.changed.set()
+
+    def _admit(self) -> None:
+        admitted_any = False
+        while self.in_flight < self.max_in_flight and self._queues:
+            session_id, queue = next(iter(self._queues.items()))
+            ticket = queue.popleft()
+            if queue:
+                # Round-robin: the session waits for the others
+                self._queues.move_to_end(session_id)
+            else:
+                del self._queues[session_id]
+
+            wait = time.perf_counter() - ticket.enqueued
+            self.in_flight += 1
+            self.admitted += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+            ticket.admitted = True
+            ticket.changed.set()
+            admitted_any = True
+
+        if admitted_any:
+            self._notify()
+
+    def _remove(self, ticket: _Ticket) -> None:
+        queue = self._queues.get(ticket.session_id)
+        if queue is not None and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del self._queues[ticket.session_id]
+            self._notify()
+
+    async def acquire(self, session_id: str) -> AsyncIterator[int]:
+        """Wait for a generation slot, yielding the queue position every time it changes
+
+        Nothing is yielded if the slot is free at once. After the iteration the slot is taken,
+        and `release` has to be called.
+
+        Raises
+        ------
+        LLMQueueFull
+            If there are already `max_queue` waiting requests
+        """
+        if self.in_flight >= self.max_in_flight and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFull(f"{self.queue_depth} requests are already waiting for the LLM")
+
+        ticket = _Ticket(session_id)
+        self._queues.setdefault(session_id, deque()).append(ticket)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        # A new session could go ahead of the other waiting requests
+        self._notify()
+        self._admit()
+
+        taken = False
+        try:
+            last_position = None
+            while not ticket.admitted:
+                position = self._position(ticket)
+                if position != last_position:
+                    last_position = position
+                    yield position
+
+                ticket.changed.clear()
+                if not ticket.admitted:
+                    await ticket.changed.wait()
+            taken = True
+
+        finally:
+            if not ticket.admitted:
+                # The request was cancelled while waiting
+                self._remove(ticket)
+            elif not taken:
+                # The slot was given, but nobody is going to use it
+                self.release()
+
+    def release(self) -> None:
+        """Free the generation slot and admit the next request"""
+        self.in_flight -= 1
+        self._admit()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "mean_wait_seconds": self.total_wait / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": round(self.max_wait, 3)
+        }
+
+
+class GenerationStats:
+    """Completed, cancelled and failed generations
+
+    The generation is cancelled when the client disconnects or sends a new message.
+    The tokens it did not generate are estimated by the mean length of the completed answers.
+    Failed generations (errors of the LLM) are only counted, they do not save anything.
+    """
+    def __init__(self) -> None:
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.completed_tokens = 0
+        self.cancelled_tokens = 0
+        self.saved_tokens = 0
+
+    def finish(self, answer: str) -> None:
+        self.completed += 1
+        self.completed_tokens += estimate_tokens(answer)
+
+    def cancel(self, partial_answer: str) -> None:
+        generated = estimate_tokens(partial_answer) if partial_answer else 0
+        expected = self.completed_tokens / self.completed if self.completed else 0
+
+        self.cancelled += 1
+        self.cancelled_tokens += generated
+        self.saved_tokens += max(int(expected) - generated, 0)
+
+    def fail(self) -> None:
+        self.failed += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "failed": self.failed,
+            "tokens_generated_before_cancel": self.cancelled_tokens,
+            "estimated_tokens_saved": self.saved_tokens
+        }
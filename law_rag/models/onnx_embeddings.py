@@ -0,0 +1,249 @@
+"""
+ONNX Runtime backend for the embeddings model.
+
+The HuggingFace model is exported to ONNX once, optionally quantized to int8 weights (dynamic quantization)
+and then run by ONNX Runtime on CPU. It is a drop-in replacement for `HuggingFaceEmbeddings`,
+selected by `models.embeddings_engine: onnx` in the config.
+
+You can run this .py file to export the model and to compare it with the PyTorch one.
+"""
+import time
+import threading
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+from law_rag.models.embeddings_wrapper import HuggingFaceEmbeddings, length_buckets
+from law_rag.metrics import stage
+from law_rag.config import Settings
+
+from typing import List, Dict
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def onnx_model_path(model_name: str, folder: str, quantize: bool) -> Path:
+    """Path to the exported model file"""
+    name = model_name.replace("/", "_")
+    if quantize:
+        name += "-int8"
+    return Path(folder) / name / "model.onnx"
+
+
+def export_onnx_model(model_name: str, folder: str, quantize: bool = True) -> Path:
+    """Export the HuggingFace model to ONNX and (optionally) quantize it
+
+    The export is skipped if the model file already exists.
+
+    Arguments
+    ---------
+    model_name: str
+        HuggingFace model name
+    folder: str
+        Folder to save the exported models
+    quantize: bool = True
+        Whether to make dynamic int8 quantization of the model weights
+
+    Returns
+    -------
+    path: Path
+        Path to the model that should be loaded to ONNX Runtime
+    """
+    import torch
+    from transformers import AutoModel
+
+    path = onnx_model_path(model_name, folder, quantize)
+    if path.exists():
+        return path
+
+    full_path = onnx_model_path(model_name, folder, quantize = False)
+    if not full_path.exists():
+        logger.info(f"Export {model_name} to ONNX")
+        full_path.parent.mkdir(parents = True, exist_ok = True)
+
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        model = AutoModel.from_pretrained(model_name)
+        model.eval()
+
+        dummy = tokenizer(["Что такое информация?"], return_tensors = "pt")
+        with torch.inference_mode():
+            torch.onnx.export(
+                model,
+                (dummy["input_ids"], dummy["attention_mask"]),
+                str(full_path),
+                input_names = ["input_ids", "attention_mask"],
+                output_names = ["last_hidden_state"],
+                dynamic_axes = {
+                    "input_ids": {0: "batch", 1: "sequence"},
+                    "attention_mask": {0: "batch", 1: "sequence"},
+                    "last_hidden_state": {0: "batch", 1: "sequence"}
+                },
+                opset_version = 17
+            )
+
+    if quantize:
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        logger.info(f"Quantize {model_name} to int8")
+        path.parent.mkdir(parents = True, exist_ok = True)
+        quantize_dynamic(
+            model_input = str(full_path),
+            model_output = str(path),
+            weight_type = QuantType.QInt8,
+            # The full precision large models are bigger than 2GB protobuf limit
+            use_external_data_format = True
+        )
+
+    return path
+
+
+class OnnxEmbeddings(Embeddings):
+    """Embeddings model that runs by ONNX Runtime on CPU
+
+    Pooling is the same as in `HuggingFaceEmbeddings` - the sum of the last hidden state over the real tokens.
+
+    Parameters
+    ----------
+    model_name: str
+        HuggingFace model name
+    folder: str
+        Folder with the exported models
+    quantize: bool = True
+        Whether to use the int8 quantized model
+    intra_op_threads: int = 0
+        Number of threads for one operator. 0 means ONNX Runtime default (all physical cores)
+    batch_size: int
+        Maximum number of texts in one forward pass
+    """
+    def __init__(
+        self,
+        model_name: str,
+        folder: str = Settings.models.onnx.path,
+        quantize: bool = Settings.models.onnx.quantize,
+        intra_op_threads: int = Settings.models.onnx.intra_op_threads,
+        batch_size: int = Settings.models.embeddings_batch_size
+    ) -> None:
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        # Fast tokenizers could not be used from many threads at once, ONNX Runtime session could
+        self._tokenizer_lock = threading.Lock()
+
+        path = export_onnx_model(model_name, folder, quantize)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+
+        self.session = ort.InferenceSession(
+            str(path),
+            sess_options = options,
+            providers = ["CPUExecutionProvider"]
+        )
+
+    def tokenize(self, texts: List[str], **kwargs):
+        with self._tokenizer_lock:
+            return self.tokenizer(texts, truncation = True, **kwargs)
+
+    def _forward(self, texts: List[str]) -> np.ndarray:
+        inputs = self.tokenize(texts, return_tensors = "np", padding = True)
+        feed: Dict[str, np.ndarray] = {
+            "input_ids": inputs["input_ids"].astype(np.int64),
+            "attention_mask": inputs["attention_mask"].astype(np.int64)
+        }
+        last_hidden_state = self.session.run(["last_hidden_state"], feed)[0]
+
+        # Sum pooling only over the real tokens
+        mask = feed["attention_mask"][..., None].astype(last_hidden_state.dtype)
+        return (last_hidden_state * mask).sum(axis = 1)
+
+    def embed_query(self, text: str) -> List[float]:
+        with stage("embedding"):
+            return self._forward([text])[0].tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if len(texts) == 0:
+            return []
+
+        lengths = [len(ids) for ids in self.tokenize(texts)["input_ids"]]
+        answers: List[List[float] | None] = [None] * len(texts)
+
+        for bucket in length_buckets(lengths, self.batch_size):
+            vectors = self._forward([texts[index] for index in bucket]).tolist()
+            for index, vector in zip(bucket, vectors):
+                answers[index] = vector
+
+        return answers
+
+
+def compare_with_torch(
+    texts: List[str],
+    min_similarity: float = 0.99,
+    repeats: int = 5
+) -> Dict[str, float]:
+    """Parity check and latency comparison of the ONNX model against the PyTorch one
+
+    Arguments
+    ---------
+    texts: List[str]
+        Texts to embed with both engines. Each text is embedded as a query
+    min_similarity: float = 0.99
+        Minimum allowed cosine similarity between the vectors of the same text.
+        Quantized model could not give exactly the same vectors
+    repeats: int = 5
+        How many times to embed every text for the latency measurement
+
+    Returns
+    -------
+    report: Dict[str, float]
+        The worst cosine similarity and mean query latency (ms) for both engines
+
+    Raises
+    ------
+    AssertionError
+        If some vectors are less similar than `min_similarity`
+    """
+    torch_model = HuggingFaceEmbeddings(Settings.models.embeddings_model)
+    onnx_model = OnnxEmbeddings(Settings.models.embeddings_model)
+
+    def latency(model: Embeddings) -> float:
+        # Warm up
+        model.embed_query(texts[0])
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for text in texts:
+                model.embed_query(text)
+        return (time.perf_counter() - start) / (repeats * len(texts)) * 1000
+
+    torch_vectors = np.array([torch_model.embed_query(text) for text in texts])
+    onnx_vectors = np.array([onnx_model.embed_query(text) for text in texts])
+
+    similarity = (torch_vectors * onnx_vectors).sum(axis = 1) / (
+        np.linalg.norm(torch_vectors, axis = 1) * np.linalg.norm(onnx_vectors, axis = 1)
+    )
+
+    report = {
+        "min_similarity": float(similarity.min()),
+        "torch_latency_ms": latency(torch_model),
+        "onnx_latency_ms": latency(onnx_model)
+    }
+    assert report["min_similarity"] >= min_similarity, f"ONNX embeddings differ from PyTorch ones: {report}"
+    return report
+
+
+
+if __name__ == "__main__":
+    # We can run this .py file to export the model and compare it with PyTorch one
+    report = compare_with_torch([
+        "Что такое информация?",
+        "Что такое персональные данные?",
+        "Какие права есть у субъекта персональных данных?"
+    ])
+    print(f"Min cosine similarity: {report['min_similarity']:.5f}")
+    print(f"PyTorch query latency: {report['torch_latency_ms']:.1f} ms")
+    print(f"ONNX query latency: {report['onnx_latency_ms']:.1f} ms")
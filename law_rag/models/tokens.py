@@ -0,0 +1,12 @@
+"""
+Token counts for the prompt budgets.
+
+The Ollama model tokenizer is not available in the API, so tokens are estimated by the number of characters.
+The same estimation is used when the graph is built (per-node counts) and when the prompt is assembled.
+"""
+from law_rag.config import Settings
+
+
+def estimate_tokens(text: str, chars_per_token: float = Settings.history.chars_per_token) -> int:
+    """Rough number of tokens in the text"""
+    return int(len(text) / chars_per_token) + 1
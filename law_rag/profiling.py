@@ -0,0 +1,150 @@
+"""
+Profiling without external tools.
+
+`SamplingProfiler` is a thread that takes the stacks of all other threads (`sys._current_frames`)
+every `interval` seconds and counts them. The result is in the collapsed stack format
+(`frame;frame;frame count` per line), which flamegraph.pl, speedscope and inferno read.
+It only exists while the profile is taken, so nothing is paid when nobody profiles.
+
+`profile_run` is for the build scripts: it writes pstats (cProfile), collapsed stacks
+and tracemalloc top allocations of the block, and does nothing if it is disabled.
+"""
+import os
+import sys
+import time
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from law_rag.config import Settings
+
+from typing import Iterator
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def frame_name(frame) -> str:
+    """`function (file:line of the function)`, so all samples of a function are merged"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame, thread_name: str) -> str:
+    """Stack of the frame from the root, joined by `;`, with the thread name as the root"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    names.append(thread_name)
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    """Sample the stacks of all threads of the process
+
+    ``` python
+        profiler = SamplingProfiler().start()
+        ...
+        profiler.stop()
+        print(profiler.collapsed())
+    ```
+
+    Parameters
+    ----------
+    interval: float
+        Seconds between the samples
+    """
+    def __init__(self, interval: float = Settings.api.profile_interval_ms / 1000) -> None:
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.stacks[collapse_stack(frame, names.get(thread_id, str(thread_id)))] += 1
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread = threading.Thread(target = self._sample, name = "sampling-profiler", daemon = True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        """Collapsed stacks, the most frequent first"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def sample_for(seconds: float, interval: float = Settings.api.profile_interval_ms / 1000) -> str:
+    """Sample the process for `seconds` and return the collapsed stacks. Blocks the calling thread"""
+    profiler = SamplingProfiler(interval).start()
+    try:
+        time.sleep(seconds)
+    finally:
+        profiler.stop()
+    logger.info(f"Profile: {profiler.samples} samples in {seconds} s, {len(profiler.stacks)} different stacks")
+    return profiler.collapsed()
+
+
+@contextmanager
+def profile_run(
+    name: str,
+    enabled: bool = True,
+    folder: str = Settings.system.profile_folder,
+    top_allocations: int = 25
+) -> Iterator[None]:
+    """Profile the block and write the reports to the `folder`
+
+    Files
+    -----
+    - `<name>.pstats`: cProfile statistics, for `python -m pstats` or snakeviz
+    - `<name>.collapsed`: sampled collapsed stacks for a flamegraph
+    - `<name>.allocations.txt`: lines with the largest memory allocations still held at the end (tracemalloc)
+
+    If not `enabled`, the block just runs.
+    """
+    if not enabled:
+        yield
+        return
+
+    os.makedirs(folder, exist_ok = True)
+    path = os.path.join(folder, name)
+
+    tracemalloc.start()
+    sampler = SamplingProfiler().start()
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+
+    finally:
+        profile.disable()
+        sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+
+        profile.dump_stats(f"{path}.pstats")
+
+        with open(f"{path}.collapsed", "w", encoding = "utf-8") as file:
+            file.write(sampler.collapsed())
+
+        with open(f"{path}.allocations.txt", "w", encoding = "utf-8") as file:
+            for statistic in snapshot.statistics("lineno")[:top_allocations]:
+                file.write(f"{statistic}\n")
+
+        print(f"Profile is written to {path}.pstats, {path}.collapsed and {path}.allocations.txt")